@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+from collections import deque
+
+
+class SpotAllocator:
+    """Per-lot free lists of spot ids, mirrored from parking_spots.
+
+    Handing out a spot is a deque pop instead of a scan over the lot's rows.
+    The table stays the source of truth: verify() compares both and reloads
+    any lot that has drifted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free = {}      # lot_id -> deque of free spot ids
+        self._members = {}   # lot_id -> set of the same ids, for O(1) membership
+
+    def load(self, conn):
+        # Load every lot in conn's database in one pass over parking_spots;
+        # lots in other databases (shards) are left as they are
+        try:
+            rows = conn.execute(
+                'SELECT lot_id, id FROM parking_spots WHERE is_occupied = 0 ORDER BY lot_id, id'
+            ).fetchall()
+            lot_ids = [row[0] for row in conn.execute('SELECT id FROM parking_lots')]
+        except sqlite3.OperationalError:
+            # Tables not created yet; lots are loaded lazily on first use
+            return
+
+        free = {lot_id: [] for lot_id in lot_ids}
+        for lot_id, spot_id in rows:
+            free.setdefault(lot_id, []).append(spot_id)
+
+        with self._lock:
+            self._free.update((lot_id, deque(ids)) for lot_id, ids in free.items())
+            self._members.update((lot_id, set(ids)) for lot_id, ids in free.items())
+
+    def load_lot(self, conn, lot_id):
+        ids = [row[0] for row in conn.execute(
+            'SELECT id FROM parking_spots WHERE lot_id = ? AND is_occupied = 0 ORDER BY id',
+            (lot_id,)
+        )]
+        with self._lock:
+            self._free[lot_id] = deque(ids)
+            self._members[lot_id] = set(ids)
+
+    def acquire(self, conn, lot_id):
+        """Take a free spot id out of the lot's free list, or None if it is full."""
+        if lot_id not in self._free:
+            self.load_lot(conn, lot_id)
+
+        with self._lock:
+            free = self._free.get(lot_id)
+            if not free:
+                return None
+            spot_id = free.popleft()
+            self._members[lot_id].discard(spot_id)
+            return spot_id
+
+    def release(self, lot_id, spot_id):
+        with self._lock:
+            members = self._members.get(lot_id)
+            if members is None or spot_id in members:
+                # Unknown lot (loaded lazily later) or already free
+                return
+            members.add(spot_id)
+            self._free[lot_id].append(spot_id)
+
+    def forget(self, lot_id):
+        with self._lock:
+            self._free.pop(lot_id, None)
+            self._members.pop(lot_id, None)
+
+    def free_count(self, lot_id):
+        with self._lock:
+            members = self._members.get(lot_id)
+            return len(members) if members is not None else None
+
+    def verify(self, conn, lot_id=None):
+        """Compare the free lists against parking_spots and reload drifted lots.
+
+        Returns {lot_id: (missing, extra)} where missing are free spots the
+        allocator did not know about and extra are spots it would have handed
+        out although they are taken.
+        """
+        query = 'SELECT lot_id, id FROM parking_spots WHERE is_occupied = 0'
+        params = ()
+        if lot_id is not None:
+            query += ' AND lot_id = ?'
+            params = (lot_id,)
+
+        actual = {}
+        for row_lot_id, spot_id in conn.execute(query, params):
+            actual.setdefault(row_lot_id, set()).add(spot_id)
+
+        with self._lock:
+            if lot_id is not None:
+                known_lots = {lot_id} if lot_id in self._members else set()
+            else:
+                known_lots = set(self._members)
+
+            drift = {}
+            for checked_lot in known_lots | set(actual):
+                if checked_lot not in self._members:
+                    # Never loaded; nothing to drift from
+                    continue
+                expected = actual.get(checked_lot, set())
+                have = self._members[checked_lot]
+                if expected != have:
+                    drift[checked_lot] = (sorted(expected - have), sorted(have - expected))
+
+            for drifted_lot in drift:
+                ids = sorted(actual.get(drifted_lot, ()))
+                self._free[drifted_lot] = deque(ids)
+                self._members[drifted_lot] = set(ids)
+
+        return drift
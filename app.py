@@ -1,22 +1,231 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, get_flashed_messages
+from flask import Flask, render_template, request, redirect, url_for, session, flash, get_flashed_messages, Response, stream_with_context, jsonify
 import sqlite3
 import os
-from datetime import datetime,timedelta
+from datetime import datetime
 import random
-from werkzeug.security import generate_password_hash
+import csv
+import io
+import math
+import atexit
+import logging
+from werkzeug.middleware.proxy_fix import ProxyFix
+from allocator import SpotAllocator
+import booking
+import provisioning
+import history_pages
+import export
+import vehicle_search
+import user_state
+import rollups
+import archive
+import metrics
+import auth
+import tariff
+import spot_counts
+import shards
+import checkout
+import replica
+import spot_grid
+import lot_index
+import db
+from db import connect, get_db
+from migrations import migrate
+import overdue
+from overdue import OverdueScheduler
+from cache import TTLCache
+import availability
+import events
+from availability import AvailabilityFeed
+
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = 'sakshi'  # Required for sessions
-DATABASE = 'parking.db'
 # Example: global setting
-MAX_DURATION_MINUTES = 1  # 2 hours
-
-
-# Helper function to get DB connection
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+MAX_DURATION_MINUTES = 1  # overdue threshold for lots without their own max_duration_minutes
+DASHBOARD_CACHE_TTL = 10  # seconds the admin dashboard counters may be served from memory
+VEHICLE_CACHE_TTL = 300  # seconds a user's known vehicle numbers are kept
+VEHICLE_CACHE_USERS = 10000  # users whose vehicle numbers are kept at once
+# Reverse proxies in front of the app. Set it so request.remote_addr (which
+# the login throttle keys on) is the client's address from X-Forwarded-For,
+# not the proxy's; leave it at 0 when clients connect directly, or they
+# could pick their own address.
+PROXY_HOPS = int(os.environ.get('PARKING_PROXY_HOPS', 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+
+# One pooled connection per request, returned to the pool at teardown
+db.init_app(app)
+
+# Per-endpoint timings and SQL statement counts for /admin/metrics; must run
+# before anything opens a connection
+metrics.init_app(app)
+
+
+# Bring older parking.db files up to the current schema
+migrate()
+
+# Where each lot's spots and sessions live: parking.db, or one of several
+# shard files when PARKING_SHARDS is set (see shards.py)
+storage = shards.Router()
+storage.setup()
+storage.init_app(app)
+
+# Free spots per lot, kept in memory so reserve() doesn't scan parking_spots
+spot_allocator = SpotAllocator()
+for _path in storage.paths:
+    _conn = connect(_path)
+    spot_allocator.load(_conn)
+    # available_spots is kept by triggers; recount any lot that drifted anyway
+    for _lot_id, (_was, _now) in spot_counts.reconcile(_conn).items():
+        log.warning('lot %s: available_spots was %s, recounted to %s', _lot_id, _was, _now)
+    _conn.close()
+
+# Flags sessions as overdue when they pass their lot's time limit, one
+# scheduler per shard
+overdue_schedulers = [OverdueScheduler(MAX_DURATION_MINUTES, path) for path in storage.paths]
+for _scheduler in overdue_schedulers:
+    _scheduler.start()
+
+# Snapshots the report pages read, so their scans stay off the live files
+replicas = [replica.Replica(path) for path in storage.paths]
+for _replica in replicas:
+    _replica.start()
+    atexit.register(_replica.stop)
+storage.use_replicas(replicas)
+
+# Admin dashboard counters and lot list
+dashboard_cache = TTLCache(DASHBOARD_CACHE_TTL)
+
+# Vehicle numbers per user for the dashboard's and profile's vehicle lists
+vehicle_cache = TTLCache(VEHICLE_CACHE_TTL, max_entries=VEHICLE_CACHE_USERS)
+
+# view_spots pages, encoded once and dropped when a spot on them changes
+spot_grid_cache = spot_grid.GridCache()
+
+# Lots by pin code for user_dashboard and /api/lots/search, ranked with the
+# allocator's live free counts; built on first use
+lots_by_pin = lot_index.LotIndex(spot_allocator.free_count)
+
+# Password checks, legacy plaintext rehashing and login throttling
+authenticator = auth.Authenticator()
+
+# Versioned availability JSON for kiosks and mobile clients
+availability_feed = AvailabilityFeed()
+
+# Live occupancy pushed to open dashboards over Server-Sent Events
+occupancy_events = events.Broker()
+
+
+# Write paths call these after they commit so in-memory views stay fresh
+def occupancy_changed(lot_id, spot_id=None, occupied=None, user_email=None):
+    # A spot in lot_id was taken or freed. The dashboard's open session
+    # count moves with it; its lot list catches up within DASHBOARD_CACHE_TTL.
+    if occupied is None:
+        dashboard_cache.invalidate('summary')
+    else:
+        dashboard_cache.update('summary', lambda stats: dict(
+            stats, active_reservations=stats['active_reservations'] + (1 if occupied else -1)))
+    if spot_id is not None:
+        spot_grid_cache.spot_changed(lot_id, spot_id)
+    else:
+        spot_grid_cache.lot_changed(lot_id)
+    availability_feed.bump(lot_id)
+    occupancy_events.publish('spot', lot_id, spot_id=spot_id, occupied=occupied,
+                             user_email=user_email,
+                             available_spots=spot_allocator.free_count(lot_id))
+
+
+def lots_changed(lot_id=None):
+    # A lot was created, edited or deleted; lot_id is None when several were
+    dashboard_cache.clear()
+    spot_grid_cache.lot_changed(lot_id)
+    if lot_id is None:
+        lots_by_pin.rebuild(storage.gather(lot_index.read_lots))
+    else:
+        lots_by_pin.update(storage.db(lot_id), lot_id)
+    availability_feed.bump(lot_id)
+    occupancy_events.publish('lots', lot_id)
+
+
+def discover_lots(pin_prefix, nearby=True, limit=lot_index.DISCOVERY_LIMIT):
+    if lots_by_pin.stale():
+        lots_by_pin.rebuild(storage.gather(lot_index.read_lots))
+    return lots_by_pin.search(pin_prefix, nearby, limit)
+
+
+def known_vehicles(user_id):
+    # Plates from every shard the user has parked in, each once
+    plates = storage.fan_out(lambda conn: user_state.vehicle_numbers(conn, user_id))
+    return tuple(dict.fromkeys(plate for shard_plates in plates for plate in shard_plates))
+
+
+def history_page(cursor, snapshot=False, **filters):
+    # A lot lives in one shard; anything wider is read from all and merged
+    if 'lot_id' in filters:
+        return history_pages.page(storage.db(filters['lot_id'], snapshot), cursor=cursor, **filters)
+    return history_pages.merge_pages(storage.fan_out(
+        lambda conn: history_pages.page(conn, cursor=cursor, **filters), snapshot))
+
+
+def snapshot_info():
+    # For the "data as of" line on report pages; None while they read live data
+    taken_at = storage.snapshot_taken_at()
+    if taken_at is None:
+        return None
+    return {'taken_at': taken_at.isoformat(), 'age': int((datetime.now() - taken_at).total_seconds())}
+
+
+def lot_names():
+    return storage.gather(lambda conn: conn.execute('SELECT id, name FROM parking_lots').fetchall(),
+                          key=lambda lot: lot['name'])
+
+
+def users_with_spots():
+    # Users come from the catalog, the spot each one holds from whichever
+    # shard it is in
+    held = {row['current_user_id']: row for row in storage.gather(lambda conn: conn.execute('''
+        SELECT ps.current_user_id, ps.spot_number, pl.name AS lot_name
+        FROM parking_spots ps
+        JOIN parking_lots pl ON ps.lot_id = pl.id
+        WHERE ps.current_user_id IS NOT NULL
+    ''').fetchall())}
+    users = []
+    for user in get_db().execute('SELECT id, full_name, email FROM users WHERE role = "user"'):
+        spot = held.get(user['id'])
+        users.append({
+            'user_id': user['id'],
+            'full_name': user['full_name'],
+            'email': user['email'],
+            'spot_number': spot['spot_number'] if spot else None,
+            'lot_name': spot['lot_name'] if spot else None,
+        })
+    return users
+
+
+def release_held_spot(user_id):
+    # booking.release_spot, in whichever shard the user's spot is
+    index = storage.user_shard(user_id)
+    if index is None:
+        return None
+    released = booking.release_spot(storage.shard_db(index), spot_allocator, user_id)
+    storage.release_claims([user_id])
+    return released
+
+
+def auto_checked_out(lot_id, spot_id, user_id):
+    # checkout.auto_checkout freed user_id's spot_id after closing their stale session
+    metrics.RELEASES.inc('auto_checkout')
+    occupancy_changed(lot_id, spot_id, False)
+    storage.release_claims([user_id])
+
+
+# Closes sessions left open for more than a day and frees their spots
+auto_checkout_schedulers = [checkout.AutoCheckoutScheduler(spot_allocator, on_freed=auto_checked_out, path=path)
+                            for path in storage.paths]
+for _scheduler in auto_checkout_schedulers:
+    _scheduler.start()
 
 @app.template_filter('format_datetime')
 def format_datetime(value):
@@ -46,16 +255,21 @@ def register():
         pin_code = request.form['pin_code']
         role = 'user'  # Force role as 'user' for normal registrations
 
-        conn = get_db_connection()
         try:
-            conn.execute('INSERT INTO users (email, password, full_name, address, pin_code, role) VALUES (?, ?, ?, ?, ?, ?)',
-                         (email, password, full_name, address, pin_code, role))
+            hashed = authenticator.hash_password(password)
+        except auth.LoginBusy:
+            return "Server is busy, please try again.", 503
+
+        conn = get_db()
+        try:
+            user_id = conn.execute('INSERT INTO users (email, password, full_name, address, pin_code, role) VALUES (?, ?, ?, ?, ?, ?)',
+                                   (email, hashed, full_name, address, pin_code, role)).lastrowid
             conn.commit()
+            storage.replicate_user(user_id)
+            dashboard_cache.invalidate('summary')
             return redirect(url_for('login'))
         except sqlite3.IntegrityError:
             return "Email already registered. Try logging in."
-        finally:
-            conn.close()
 
     return render_template('register.html')
 
@@ -64,7 +278,7 @@ def profile():
     if 'id' not in session:
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
+    conn = get_db()
     user = conn.execute('SELECT * FROM users WHERE id = ?', (session['id'],)).fetchone()
 
     if request.method == 'POST':
@@ -74,22 +288,31 @@ def profile():
         new_password = request.form.get('password')
 
         if new_password:
-            hashed = generate_password_hash(new_password)
+            try:
+                hashed = authenticator.hash_password(new_password)
+            except auth.LoginBusy:
+                # Nothing saved; the form is shown again as it was
+                flash('Server is busy, please try again.', 'danger')
+                vehicles = vehicle_cache.get_or_load(session['id'], lambda: known_vehicles(session['id']))
+                return render_template('profile.html', user=user, vehicles=vehicles), 503
             conn.execute('UPDATE users SET full_name = ?, address = ?, pin_code = ?, password = ? WHERE id = ?',
                          (full_name, address, pin_code, hashed, session['id']))
         else:
             conn.execute('UPDATE users SET full_name = ?, address = ?, pin_code = ? WHERE id = ?',
                          (full_name, address, pin_code, session['id']))
         conn.commit()
+        storage.replicate_user(session['id'])
+        # The dashboard greets the user by the name stored in the session,
+        # and starts its lot search from the pin code stored there
+        session['full_name'] = full_name
+        session['pin_code'] = pin_code
+        if 'user' in session:
+            session['user'] = dict(session['user'], full_name=full_name)
         flash('Profile updated successfully.', 'success')
         return redirect(url_for('profile'))
 
-    # Get distinct vehicle numbers from history
-    vehicles = conn.execute(
-        'SELECT DISTINCT vehicle_number FROM parking_history WHERE user_id = ?',
-        (session['id'],)
-    ).fetchall()
-    conn.close()
+    # Every vehicle the user has parked (archived sessions included)
+    vehicles = vehicle_cache.get_or_load(session['id'], lambda: known_vehicles(session['id']))
 
     return render_template('profile.html', user=user, vehicles=vehicles)
 
@@ -100,12 +323,16 @@ def login():
         email = request.form['email']
         password = request.form['password']
 
-        conn = get_db_connection()
-        user = conn.execute(
-            'SELECT * FROM users WHERE email = ? AND password = ?', 
-            (email, password)
-        ).fetchone()
-        conn.close()
+        ip = request.remote_addr or 'unknown'
+        wait = authenticator.retry_after(ip, email)
+        if wait:
+            return render_template('login.html',
+                                   error=f'Too many login attempts. Try again in {int(wait) + 1} seconds.'), 429
+
+        try:
+            user = authenticator.authenticate(get_db(), ip, email, password)
+        except auth.LoginBusy:
+            return render_template('login.html', error='Server is busy, please try again.'), 503
 
         if user:
             session['user'] = {
@@ -117,6 +344,7 @@ def login():
             session['id'] = user['id']
             session['role'] = user['role']
             session['full_name'] = user['full_name']
+            session['pin_code'] = user['pin_code']
 
             if user['role'] == 'admin':
                 return redirect(url_for('admin_dashboard'))
@@ -135,52 +363,54 @@ def admin_dashboard():
     if 'role' not in session or session['role'] != 'admin':
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
-
-    # Summary stats
-    total_lots = conn.execute('SELECT COUNT(*) FROM parking_lots').fetchone()[0]
-    total_spots = conn.execute('SELECT COUNT(*) FROM parking_spots').fetchone()[0]
-    active_reservations = conn.execute('SELECT COUNT(*) FROM parking_history WHERE exit_time IS NULL').fetchone()[0]
-    total_users = conn.execute('SELECT COUNT(*) FROM users WHERE role = "user"').fetchone()[0]
-
-    lots = conn.execute('SELECT * FROM parking_lots').fetchall()
-
-    # Time-Based Overdue Alert Logic
-    max_duration = timedelta(minutes=1)  # You can change this to any threshold
+    conn = get_db()
+
+    def load_summary():
+        # Lot-side counts summed over the shards, users from the catalog
+        lot_counts = storage.fan_out(lambda conn: tuple(conn.execute('''
+            SELECT (SELECT COUNT(*) FROM parking_lots),
+                   (SELECT COUNT(*) FROM parking_spots),
+                   (SELECT COUNT(*) FROM parking_history WHERE exit_time IS NULL)
+        ''').fetchone()))
+        total_lots, total_spots, active_reservations = (sum(column) for column in zip(*lot_counts))
+        return {
+            'total_lots': total_lots,
+            'total_spots': total_spots,
+            'active_reservations': active_reservations,
+            'total_users': conn.execute('SELECT COUNT(*) FROM users WHERE role = "user"').fetchone()[0],
+        }
+
+    # Summary stats, cached for a few seconds; lot and user writes drop them
+    stats = dashboard_cache.get_or_load('summary', load_summary)
+
+    lots = dashboard_cache.get_or_load('lots', lambda: storage.gather(
+        lambda conn: [dict(row) for row in conn.execute('SELECT * FROM parking_lots')],
+        key=lambda lot: lot['id']))
+
+    # Time-Based Overdue Alert Logic: the scheduler has already flagged them
     now = datetime.now()
-
-    overdue = conn.execute('''
-        SELECT r.vehicle_number, r.entry_time, u.full_name, l.name AS lot_name
-        FROM parking_history r
-        JOIN users u ON r.user_id = u.id
-        JOIN parking_lots l ON r.lot_id = l.id
-        WHERE r.exit_time IS NULL
-    ''').fetchall()
-
     alerts = []
-    for row in overdue:
+    for row in storage.gather(overdue.alerts, key=lambda row: row['entry_time']):
         entry_time = datetime.fromisoformat(row['entry_time'])
         duration = now - entry_time
-        if duration > max_duration:
-            alerts.append({
-                'vehicle': row['vehicle_number'],
-                'user': row['full_name'],
-                'lot': row['lot_name'],
-                'entry_time': entry_time.strftime('%d %b %Y, %I:%M %p'),
-                'duration': str(duration).split('.')[0]  # trim microseconds
-            })
-
-    conn.close()
+        alerts.append({
+            'vehicle': row['vehicle_number'],
+            'user': row['full_name'],
+            'lot': row['lot_name'],
+            'entry_time': entry_time.strftime('%d %b %Y, %I:%M %p'),
+            'duration': str(duration).split('.')[0]  # trim microseconds
+        })
 
     return render_template(
         'admin_dashboard.html',
         full_name=session.get('full_name'),
-        total_lots=total_lots,
-        total_spots=total_spots,
-        active_reservations=active_reservations,
-        total_users=total_users,
+        total_lots=stats['total_lots'],
+        total_spots=stats['total_spots'],
+        active_reservations=stats['active_reservations'],
+        total_users=stats['total_users'],
         lots=lots,
-        alerts=alerts  # pass to template
+        alerts=alerts,  # pass to template
+        auto_checkout_hours=checkout.AUTO_CHECKOUT_AFTER_HOURS,
     )
 
 
@@ -196,26 +426,12 @@ def create_lot():
         base_duration = int(request.form['base_duration'])
         extra_hour_price = float(request.form['extra_hour_price'])
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO parking_lots 
-            (name, address, pin_code, total_spots, available_spots, base_price, base_duration, extra_hour_price)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (name, address, pin_code, total_spots, total_spots, base_price, base_duration, extra_hour_price))
-
-        lot_id = cursor.lastrowid
-
-        for i in range(1, total_spots + 1):
-            spot_number = f"Spot-{i}"
-            cursor.execute('''
-                INSERT INTO parking_spots (lot_id, spot_number, is_occupied)
-                VALUES (?, ?, 0)
-            ''', (lot_id, spot_number))
-
+        conn, lot_id = storage.new_lot()
+        provisioning.create_lot(conn, name, address, pin_code, total_spots, lot_id,
+                                base_price=base_price, base_duration=base_duration,
+                                extra_hour_price=extra_hour_price)
         conn.commit()
-        conn.close()
+        lots_changed()
 
         return redirect(url_for('admin_dashboard'))
 
@@ -224,16 +440,16 @@ def create_lot():
 
 @app.route('/view_spots/<int:lot_id>')
 def view_spots(lot_id):
-    conn = get_db_connection()
+    # Same check as occupancy_stream, which the page subscribes to
+    if 'id' not in session and session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    page = max(1, request.args.get('page', 1, type=int))
+    conn = storage.db(lot_id)
     lot = conn.execute('SELECT * FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
-    spots = conn.execute('''
-        SELECT parking_spots.*, users.email as user_email 
-        FROM parking_spots 
-        LEFT JOIN users ON parking_spots.current_user_id = users.id
-        WHERE lot_id = ?
-    ''', (lot_id,)).fetchall()
-    conn.close()
-    return render_template('view_spots.html', lot=lot, spots=spots)
+    # The spots themselves go out as a compact payload the page expands
+    grid = spot_grid_cache.page(conn, lot_id, page)
+    return render_template('view_spots.html', lot=lot, grid=grid)
 
 @app.route('/add_lot', methods=['GET', 'POST'])
 def add_lot():
@@ -243,76 +459,151 @@ def add_lot():
         pin_code = request.form['pin_code']
         total_spots = int(request.form['total_spots'])
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO parking_lots (name, address, pin_code, total_spots, available_spots)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (name, address, pin_code, total_spots, total_spots))
-        lot_id = cursor.lastrowid
-
+        conn, lot_id = storage.new_lot()
         # Auto-create parking spots
-        for i in range(1, total_spots + 1):
-            spot_number = f"Spot-{i}"
-            cursor.execute('''
-                INSERT INTO parking_spots (lot_id, spot_number)
-                VALUES (?, ?)
-            ''', (lot_id, spot_number))
-
+        provisioning.create_lot(conn, name, address, pin_code, total_spots, lot_id)
         conn.commit()
-        conn.close()
+        lots_changed()
 
         return redirect(url_for('view_lots'))
 
     return render_template('add_lot.html')
 
+@app.route('/admin/lots/import', methods=['GET', 'POST'])
+def import_lots():
+    if 'role' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
+
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV file to import.', 'danger')
+            return redirect(url_for('import_lots'))
+
+        # Read the upload as a text stream so rows are parsed one at a time
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        try:
+            lots, spots, skipped, errors = provisioning.import_lots_csv(get_db(), lines, storage.new_lot)
+        except (provisioning.LotImportError, UnicodeDecodeError, csv.Error) as e:
+            # Chunks committed before the error are kept
+            lots_changed()
+            flash(f'Import stopped: {e}', 'danger')
+            return redirect(url_for('import_lots'))
+        lots_changed()
+
+        flash(f'Imported {lots} lots with {spots} spots.', 'success')
+        if skipped:
+            details = '; '.join(f'line {line}: {message}' for line, message in errors)
+            flash(f'Skipped {skipped} rows. {details}', 'warning')
+        return redirect(url_for('view_lots'))
+
+    return render_template('import_lots.html')
+
 @app.route('/admin_users')
 def admin_users():
     if 'user' not in session or session['user']['role'] != 'admin':
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
-    users = conn.execute('SELECT * FROM users WHERE role = "user"').fetchall()
-
     # Fetch user and their parking spot (if any)
-    user_spots = conn.execute('''
-        SELECT u.id AS user_id, u.full_name, u.email, ps.spot_number, pl.name AS lot_name
-        FROM users u
-        LEFT JOIN parking_spots ps ON u.id = ps.current_user_id
-        LEFT JOIN parking_lots pl ON ps.lot_id = pl.id
-        WHERE u.role = "user"
-    ''').fetchall()
-    conn.close()
-    print("Session:", session.get('user'))
-    return render_template('admin_users.html', user_spots=user_spots)
+    return render_template('admin_users.html', user_spots=users_with_spots())
+
+@app.route('/api/lots')
+@app.route('/api/lots/<int:lot_id>')
+def api_lots(lot_id=None):
+    # Unchanged since the client's last poll: answer from memory, no SQLite
+    etag = availability_feed.current_etag(lot_id)
+    if etag and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    def load():
+        query = f'SELECT {", ".join(availability.LOT_FIELDS)} FROM parking_lots'
+        if lot_id is None:
+            return storage.gather(lambda conn: conn.execute(query + ' ORDER BY id').fetchall(),
+                                  key=lambda lot: lot['id'])
+        return storage.db(lot_id).execute(query + ' WHERE id = ?', (lot_id,)).fetchall()
+
+    etag, body = availability_feed.payload(lot_id, load)
+    if body is None:
+        return jsonify(error='lot not found'), 404
+
+    response = Response(body, content_type='application/json')
+    response.headers['Cache-Control'] = 'no-cache'
+    if etag:
+        response.set_etag(etag)
+    return response.make_conditional(request)
+
+@app.route('/api/lots/search')
+def api_lots_search():
+    # ?pin=5600&nearby=0&limit=50; answered from the in-memory index
+    limit = request.args.get('limit', lot_index.DISCOVERY_LIMIT, type=int)
+    if not 1 <= limit <= 100:
+        return jsonify(error='limit must be between 1 and 100'), 400
+    lots = discover_lots(request.args.get('pin', ''), request.args.get('nearby', '1') == '1', limit)
+    return jsonify(lots=lots)
+
+@app.route('/api/lots/<int:lot_id>/quote')
+def api_quote(lot_id):
+    try:
+        hours = float(request.args['hours'])
+    except (KeyError, ValueError):
+        return jsonify(error='hours must be a number'), 400
+    if not math.isfinite(hours) or hours < 0:
+        return jsonify(error='hours must be a number'), 400
+
+    quote = tariff.quote(storage.db(lot_id), lot_id, hours)
+    if quote is None:
+        return jsonify(error='lot not found'), 404
+    return jsonify(quote)
+
+@app.route('/events/occupancy')
+def occupancy_stream():
+    if 'id' not in session and session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    lot_id = request.args.get('lot_id', type=int)
+    try:
+        subscription = occupancy_events.subscribe(lot_id, admin=session.get('role') == 'admin')
+    except events.TooManySubscribers:
+        return Response('Too many open event streams, try again later.', status=503,
+                        headers={'Retry-After': '30'})
+
+    # No stream_with_context: the generator never needs the request (or a
+    # pooled connection), so the context is torn down right away
+    response = Response(occupancy_events.stream(subscription), content_type='text/event-stream')
+    # The stream's own cleanup only runs once it has started; a client gone
+    # before the first chunk would keep its subscriber slot
+    response.call_on_close(lambda: occupancy_events.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let a proxy buffer the stream
+    return response
+
+@app.route('/admin/cache_stats')
+def cache_stats():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    return jsonify(dashboard=dashboard_cache.stats(), vehicles=vehicle_cache.stats(),
+                   spot_grid=spot_grid_cache.stats(), occupancy_events=occupancy_events.stats())
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    if session.get('role') != 'admin' and not metrics.authorized():
+        return redirect(url_for('login'))
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/admin/reservations')
 def admin_reservations():
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
-    history = conn.execute('''
-        SELECT 
-            l.name AS lot_name,
-            l.address AS lot_address,
-            s.spot_number,
-            h.vehicle_number,
-            h.entry_time,
-            h.exit_time,
-            h.cost,
-            u.full_name AS user_name
-        FROM parking_history h
-        JOIN parking_spots s ON h.spot_id = s.id
-        JOIN parking_lots l ON h.lot_id = l.id
-        JOIN users u ON h.user_id = u.id
-        ORDER BY h.entry_time DESC
-    ''').fetchall()
-    conn.close()
-
-    # Convert and add duration
+    filters = history_pages.parse_filters(request.args)
+    snapshot = snapshot_info()
+    rows, next_cursor = history_page(request.args.get('cursor'), snapshot=True, **filters)
+
+    # Convert and add duration (only for the rows on this page)
     converted_history = []
-    for row in history:
+    for row in rows:
         row_dict = dict(row)
         entry = row_dict['entry_time']
         exit = row_dict['exit_time']
@@ -325,8 +616,31 @@ def admin_reservations():
 
         converted_history.append(row_dict)
 
-    return render_template('admin_reservations.html', history=converted_history)
+    lots = lot_names()
+
+    return render_template('admin_reservations.html', history=converted_history, lots=lots,
+                           filters=history_pages.filter_args(filters), next_cursor=next_cursor,
+                           snapshot=snapshot)
+
 
+@app.route('/admin/export/history')
+def export_history():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return f"Unknown export format '{fmt}'. Use csv or ndjson.", 400
+    gzip = request.args.get('gzip') in ('1', 'true', 'yes')
+    filters = history_pages.parse_filters(request.args)
+
+    # The generator runs after this view returns; stream_with_context keeps the
+    # request (and its pooled connection) alive until the last row is sent
+    conns = [storage.db(filters['lot_id'])] if 'lot_id' in filters else storage.all_dbs()
+    body = export.stream(conns, fmt, gzip, **filters)
+    return Response(stream_with_context(body),
+                    content_type=export.content_type(fmt, gzip),
+                    headers={'Content-Disposition': f'attachment; filename={export.filename(fmt, gzip)}'})
 
 
 @app.route('/admin/view_users')
@@ -334,17 +648,7 @@ def view_users():
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
-    users = conn.execute('''
-        SELECT u.full_name, u.email, ps.spot_number, pl.name as lot_name
-        FROM users u
-        LEFT JOIN parking_spots ps ON u.id = ps.current_user_id
-        LEFT JOIN parking_lots pl ON ps.lot_id = pl.id
-        WHERE u.role = 'user'
-    ''').fetchall()
-    conn.close()
-
-    return render_template('view_users.html', users=users)
+    return render_template('view_users.html', users=users_with_spots())
 
 
 @app.route('/user_dashboard')
@@ -352,34 +656,33 @@ def user_dashboard():
     if 'id' not in session or session.get('role') != 'user':
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
     user_id = session['id']
 
-    lots = [dict(row) for row in conn.execute('SELECT * FROM parking_lots').fetchall()]
-    spot_row = conn.execute('SELECT * FROM parking_spots WHERE current_user_id = ?', (user_id,)).fetchone()
-    spot = dict(spot_row) if spot_row else None
-    
-    current_lot = None
-    if spot:
-        lot_row = conn.execute('SELECT * FROM parking_lots WHERE id = ?', (spot['lot_id'],)).fetchone()
-        current_lot = dict(lot_row) if lot_row else None
-
-    full_name = conn.execute('SELECT full_name FROM users WHERE id = ?', (user_id,)).fetchone()['full_name']
-    vehicle_numbers = conn.execute(
-    'SELECT DISTINCT vehicle_number FROM parking_history WHERE user_id = ?',
-    (session['id'],)
-    ).fetchall()
-
-    conn.close()
-    # print("Session:", session)
+    spot, current_lot = user_state.merge_current_spots(
+        storage.fan_out(lambda conn: user_state.current_spot(conn, user_id)))
+    vehicle_numbers = vehicle_cache.get_or_load(user_id, lambda: known_vehicles(user_id))
+
+    # Lots near the pin searched for, or the user's own pin code to start with
+    pin = request.args.get('pin')
+    if pin is None:
+        pin = session.get('pin_code') or ''
+    # The form sends nearby=0 and, when ticked, nearby=1 too; on by default
+    nearby = request.args.getlist('nearby') in ([], ['0', '1'], ['1'])
+    lots = discover_lots(pin, nearby)
+    # Nothing there: list every lot rather than leave nothing to reserve
+    everywhere = not lots and bool(pin.strip())
+    if everywhere:
+        lots = discover_lots('', limit=None)
 
     return render_template('user_dashboard.html',
-                           full_name=full_name,
+                           full_name=session.get('full_name'),
                            lots=lots,
+                           pin=pin,
+                           nearby=nearby,
+                           everywhere=everywhere,
                            current_spot=spot,
-                           current_lot=current_lot ,
-                            vehicle_numbers=[row['vehicle_number'] for row in vehicle_numbers]
-)
+                           current_lot=current_lot,
+                           vehicle_numbers=vehicle_numbers)
 
 
 
@@ -388,8 +691,11 @@ def edit_lot(lot_id):
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
+    conn = storage.db(lot_id)
     lot = conn.execute('SELECT * FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
+    if lot is None:
+        flash('Parking lot not found.', 'danger')
+        return redirect(url_for('view_lots'))
 
     if request.method == 'POST':
         name = request.form['name']
@@ -398,19 +704,26 @@ def edit_lot(lot_id):
         base_price = float(request.form['base_price'])
         base_duration = int(request.form['base_duration'])
         extra_hour_price = float(request.form['extra_hour_price'])
+        # Blank means "use the default limit"
+        max_duration = request.form.get('max_duration_minutes', '').strip()
+        max_duration_minutes = int(max_duration) if max_duration else None
 
         conn.execute('''
             UPDATE parking_lots 
             SET name = ?, address = ?, pin_code = ?,
-                base_price = ?, base_duration = ?, extra_hour_price = ?
+                base_price = ?, base_duration = ?, extra_hour_price = ?,
+                max_duration_minutes = ?
             WHERE id = ?
-        ''', (name, address, pin_code, base_price, base_duration, extra_hour_price, lot_id))
+        ''', (name, address, pin_code, base_price, base_duration, extra_hour_price,
+              max_duration_minutes, lot_id))
         conn.commit()
-        conn.close()
+        lots_changed(lot_id)
+
+        if max_duration_minutes != lot['max_duration_minutes']:
+            overdue_schedulers[storage.shard_of(lot_id)].reset_lot(conn, lot_id)
         return redirect(url_for('view_lots'))
 
-    conn.close()
-    return render_template('edit_lot.html', lot=lot)
+    return render_template('edit_lot.html', lot=lot, default_max_duration=MAX_DURATION_MINUTES)
 
 
     
@@ -422,58 +735,25 @@ def reserve(lot_id):
     user_id = session['user']['id']
     vehicle_number = request.form.get("vehicle_number_manual") or request.form.get("vehicle_number")
 
-    conn = get_db_connection()
-
-    # Check if user already has a reservation
-    active = conn.execute('''
-        SELECT * FROM parking_spots
-        WHERE current_user_id = ? AND is_occupied = 1
-    ''', (user_id,)).fetchone()
-
-    if active:
-        conn.close()
+    try:
+        # reserve_spot only sees this lot's shard; the claim covers the others
+        with storage.claim(user_id, lot_id):
+            reservation = booking.reserve_spot(storage.db(lot_id), spot_allocator, lot_id, user_id,
+                                               vehicle_number)
+    except booking.AlreadyReserved:
+        metrics.RESERVATION_REJECTIONS.inc('already_reserved')
         return "You already have an active reservation. Please release it first."
-
-    # Find a free spot
-    spot = conn.execute('''
-        SELECT * FROM parking_spots
-        WHERE lot_id = ? AND is_occupied = 0
-        LIMIT 1
-    ''', (lot_id,)).fetchone()
-
-    if not spot:
-        conn.close()
+    except booking.NoSpotAvailable:
+        metrics.RESERVATION_REJECTIONS.inc('no_spot_available')
         return "No available spots in this lot."
 
-    # Reserve spot
-    now = datetime.now().isoformat()
-    conn.execute('''
-        UPDATE parking_spots
-        SET is_occupied = 1, current_user_id = ?
-        WHERE id = ?
-    ''', (user_id, spot['id']))
-
-    # Add entry to parking history
-    conn.execute('''
-        INSERT INTO parking_history (user_id, spot_id, lot_id, vehicle_number, entry_time)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, spot['id'], lot_id, vehicle_number, now))
-
-    # Decrease availability
-    conn.execute('''
-        UPDATE parking_lots
-        SET available_spots = available_spots - 1
-        WHERE id = ?
-    ''', (lot_id,))
-
-    # Insert into reservations table so history shows up
-    conn.execute('''
-        INSERT INTO reservations (user_id, spot_id, vehicle_number, booking_time)
-        VALUES (?, ?, ?, ?)
-    ''', (user_id, spot['id'], vehicle_number, now))
+    metrics.RESERVATIONS.inc()
+    # reserve_spot adds a new plate to user_vehicles; keep a cached list in step
+    vehicle_cache.update(user_id, lambda plates: plates if vehicle_number in plates
+                         else plates + (vehicle_number,))
+    overdue_schedulers[storage.shard_of(lot_id)].schedule(reservation.history_id, lot_id, reservation.entry_time)
+    occupancy_changed(lot_id, reservation.spot_id, True, session['user'].get('email'))
 
-    conn.commit()
-    conn.close()
     # After successful reservation
     flash("Spot reserved successfully!")
     return redirect(url_for('user_dashboard'))
@@ -485,67 +765,14 @@ def release_spot():
         return redirect(url_for('login'))
 
     user_id = session['user']['id']
-    conn = get_db_connection()
-
-    # Get the spot being used by this user
-    spot = conn.execute('SELECT * FROM parking_spots WHERE current_user_id = ?', (user_id,)).fetchone()
-
-    if spot:
-        now = datetime.now()
-        now_str = now.isoformat()
-
-        # Get entry time + lot pricing details
-        history = conn.execute('''
-            SELECT ph.id, ph.entry_time, pl.base_price, pl.base_duration, pl.extra_hour_price
-            FROM parking_history ph
-            JOIN parking_lots pl ON ph.lot_id = pl.id
-            WHERE ph.user_id = ? AND ph.spot_id = ? AND ph.exit_time IS NULL
-        ''', (user_id, spot['id'])).fetchone()
-
-        if history and history['entry_time']:
-            entry_time = datetime.fromisoformat(history['entry_time'])
-            duration = now - entry_time
-            duration_hours = duration.total_seconds() / 3600
-
-            # BASE FEE calculation
-            base_price = history['base_price']
-            base_duration = history['base_duration']
-            extra_hour_price = history['extra_hour_price']
-
-            if duration_hours <= base_duration:
-                cost = round(base_price, 2)
-            else:
-                extra_hours = duration_hours - base_duration
-                cost = round(base_price + (extra_hours * extra_hour_price), 2)
-
-        else:
-            cost = None
+    released = release_held_spot(user_id)
 
-        # Mark spot as free
-        conn.execute('''
-            UPDATE parking_spots 
-            SET is_occupied = 0, current_user_id = NULL 
-            WHERE id = ?
-        ''', (spot['id'],))
-
-        # Increase lot availability
-        conn.execute('''
-            UPDATE parking_lots 
-            SET available_spots = available_spots + 1 
-            WHERE id = ?
-        ''', (spot['lot_id'],))
-
-        # Update parking history with exit time & cost
-        conn.execute('''
-            UPDATE parking_history 
-            SET exit_time = ?, cost = ?
-            WHERE id = ?
-        ''', (now_str, cost, history['id']))
-
-        conn.commit()
+    if released:
+        spot, cost = released
+        metrics.RELEASES.inc('user')
+        occupancy_changed(spot['lot_id'], spot['id'], False)
         flash(f"🔓 Spot released! Total parking cost: ₹{cost:.2f}" if cost else "🔓 Spot released!")
 
-    conn.close()
     return redirect(url_for('user_dashboard'))
 
 
@@ -554,19 +781,8 @@ def user_history():
     if 'id' not in session:
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
-    raw_history = conn.execute(
-        '''
-        SELECT r.*, r.vehicle_number, l.name AS lot_name, l.address AS lot_address, s.spot_number
-        FROM parking_history r
-        JOIN parking_spots s ON r.spot_id = s.id
-        JOIN parking_lots l ON r.lot_id = l.id
-        WHERE r.user_id = ?
-        ORDER BY r.entry_time DESC
-        ''',
-        (session['id'],)
-    ).fetchall()
-    conn.close()
+    filters = history_pages.parse_filters(request.args)
+    raw_history, next_cursor = history_page(request.args.get('cursor'), user_id=session['id'], **filters)
 
     history = []
     for row in raw_history:
@@ -587,16 +803,18 @@ def user_history():
 
         history.append(entry)
 
-    return render_template('user_history.html', history=history)
+    lots = lot_names()
+
+    return render_template('user_history.html', history=history, lots=lots,
+                           filters=history_pages.filter_args(filters), next_cursor=next_cursor)
 
 @app.route('/admin/lots')
 def view_lots():
     if 'role' not in session or session['role'] != 'admin':
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
-    lots = conn.execute('SELECT * FROM parking_lots').fetchall()
-    conn.close()
+    lots = storage.gather(lambda conn: conn.execute('SELECT * FROM parking_lots').fetchall(),
+                          key=lambda lot: lot['id'])
     return render_template('view_lots.html', lots=lots)
 
 @app.route('/admin/lot/delete/<int:lot_id>', methods=['POST'])
@@ -604,7 +822,7 @@ def delete_lot(lot_id):
     if 'role' not in session or session['role'] != 'admin':
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
+    conn = storage.db(lot_id)
 
     # Count reservations using this lot via joined spot IDs
     active = conn.execute('''
@@ -613,19 +831,17 @@ def delete_lot(lot_id):
         WHERE s.lot_id = ?
     ''', (lot_id,)).fetchone()[0]
 
-    # Check history table (this has lot_id directly)
-    history = conn.execute(
-        'SELECT COUNT(*) FROM parking_history WHERE lot_id = ?', (lot_id,)
-    ).fetchone()[0]
+    # Check history, archived sessions included (this has lot_id directly)
+    history = archive.has_history(conn, lot_id)
 
-    if active > 0 or history > 0:
-        conn.close()
+    if active > 0 or history:
         flash('Cannot delete: This lot has active or past reservations.', 'danger')
         return redirect(url_for('view_lots'))
 
     conn.execute('DELETE FROM parking_lots WHERE id = ?', (lot_id,))
     conn.commit()
-    conn.close()
+    spot_allocator.forget(lot_id)
+    lots_changed(lot_id)
 
     flash('Parking lot deleted successfully.', 'success')
     return redirect(url_for('view_lots'))
@@ -638,114 +854,79 @@ def admin_vehicles():
 
     search = request.args.get('search', '').strip()
 
-    conn = get_db_connection()
+    snapshot = snapshot_info()
     if search:
-        query = '''
-            SELECT u.full_name, u.email, ph.vehicle_number
-            FROM parking_history ph
-            JOIN users u ON ph.user_id = u.id
-            WHERE u.full_name LIKE ? OR u.email LIKE ? OR ph.vehicle_number LIKE ?
-            GROUP BY u.id, ph.vehicle_number
-            ORDER BY u.full_name
-        '''
-        like_search = f'%{search}%'
-        vehicles = conn.execute(query, (like_search, like_search, like_search)).fetchall()
+        found = storage.gather(lambda conn: vehicle_search.search(conn, search), snapshot=True)
     else:
-        vehicles = conn.execute('''
-            SELECT u.full_name, u.email, ph.vehicle_number
-            FROM parking_history ph
-            JOIN users u ON ph.user_id = u.id
-            GROUP BY u.id, ph.vehicle_number
-            ORDER BY u.full_name
-        ''').fetchall()
+        found = storage.gather(vehicle_search.list_all, snapshot=True)
+    # The same plate can show up in more than one shard
+    vehicles = sorted({tuple(row): row for row in found}.values(), key=lambda row: row['full_name'])
 
-    conn.close()
-    return render_template('admin_vehicles.html', vehicles=vehicles, search=search)
+    return render_template('admin_vehicles.html', vehicles=vehicles, search=search,
+                           snapshot=snapshot)
 
 
 @app.route('/logout')
 def logout():
     user_id = session.get('id')
 
-    conn = get_db_connection()
-
-    # Get the spot the user had (if any)
-    spot = conn.execute('''
-        SELECT * FROM parking_spots WHERE current_user_id = ?
-    ''', (user_id,)).fetchone()
+    # Free the user's spot and close (and bill) any open parking history too
+    released = None
+    if user_id is not None:
+        released = release_held_spot(user_id)
+        if released:
+            spot, _ = released
+            metrics.RELEASES.inc('logout')
+            occupancy_changed(spot['lot_id'], spot['id'], False)
 
-    if spot:
-        # Set spot as unoccupied
-        conn.execute('''
-            UPDATE parking_spots
-            SET is_occupied = 0, current_user_id = NULL
-            WHERE current_user_id = ?
-        ''', (user_id,))
+    session.clear()
+    if released and released[1]:
+        flash(f"🔓 Your spot was released on logout. Total parking cost: ₹{released[1]:.2f}")
+    return redirect(url_for('home'))
 
-        # Increment available_spots in that lot
-        conn.execute('''
-            UPDATE parking_lots
-            SET available_spots = available_spots + 1
-            WHERE id = ?
-        ''', (spot['lot_id'],))
+@app.route('/admin/auto_checkout', methods=['POST'])
+def admin_auto_checkout():
+    if 'role' not in session or session['role'] != 'admin':
+        return redirect(url_for('login'))
 
-        # Optionally, close any open parking history too
-        now = datetime.now().isoformat()
-        conn.execute('''
-            UPDATE parking_history
-            SET exit_time = ?
-            WHERE user_id = ? AND spot_id = ? AND exit_time IS NULL
-        ''', (now, user_id, spot['id']))
+    try:
+        hours = float(request.form.get('hours', checkout.AUTO_CHECKOUT_AFTER_HOURS))
+    except ValueError:
+        hours = -1
+    if not math.isfinite(hours) or hours < 0:
+        flash('Hours must be a number of 0 or more.', 'danger')
+        return redirect(url_for('admin_dashboard'))
 
-        conn.commit()
+    # Handled here rather than on the fan-out threads, which have no request
+    freed = []
+    result = checkout.combine(storage.fan_out(
+        lambda conn: checkout.auto_checkout(conn, spot_allocator, hours, on_freed=lambda *spot: freed.append(spot))))
+    for spot in freed:
+        auto_checked_out(*spot)
 
-    conn.close()
-    session.clear()
-    return redirect(url_for('home'))
+    flash(f"🧹 Checked out {result.sessions} sessions open longer than {hours:g} hours "
+          f"({result.spots_freed} spots freed, ₹{result.revenue:.2f} billed) in {result.seconds:.2f}s",
+          'success')
+    return redirect(url_for('admin_dashboard'))
 
 @app.route('/admin/analytics')
 def admin_analytics():
     if 'role' not in session or session['role'] != 'admin':
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
-
-    # Most Used Lots
-    most_used = conn.execute('''
-        SELECT l.name, COUNT(r.id) as total
-        FROM parking_history r
-        JOIN parking_lots l ON r.lot_id = l.id
-        GROUP BY l.id
-        ORDER BY total DESC
-    ''').fetchall()
-
-    #  Total Revenue Over Time (monthly)
-    revenue_over_time = conn.execute('''
-        SELECT strftime('%Y-%m', entry_time) AS month, SUM(cost) as revenue
-        FROM parking_history
-        WHERE cost IS NOT NULL
-        GROUP BY month
-        ORDER BY month
-    ''').fetchall()
-
-    #  Average Parking Duration
-    avg_duration = conn.execute('''
-        SELECT l.name, AVG(
-            julianday(exit_time) - julianday(entry_time)
-        ) * 24 as avg_hours
-        FROM parking_history r
-        JOIN parking_lots l ON r.lot_id = l.id
-        WHERE exit_time IS NOT NULL
-        GROUP BY l.id
-    ''').fetchall()
-
-    conn.close()
+    # All three read the per-lot per-day rollups, not parking_history, from the snapshot
+    snapshot = snapshot_info()
+    most_used = storage.gather(rollups.most_used_lots, key=lambda row: row['total'], reverse=True,
+                               snapshot=True)
+    revenue_over_time = rollups.merge_monthly_revenue(storage.fan_out(rollups.monthly_revenue, snapshot=True))
+    avg_duration = storage.gather(rollups.average_duration, snapshot=True)
 
     return render_template(
         'admin_analytics.html',
         most_used=most_used,
         revenue_over_time=revenue_over_time,
         avg_duration=avg_duration,
+        snapshot=snapshot,
     )
 
 
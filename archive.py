@@ -0,0 +1,169 @@
+import argparse
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+import booking
+from db import attach_archive, connect
+
+# Closed sessions older than ARCHIVE_AFTER_DAYS move from parking_history
+# into the same table in a separate file, ATTACHed as `archive` (see
+# db.attach_archive). The hot table then only holds recent and open
+# sessions, so its indexes stay small and cached.
+#
+# Reads that can reach back that far (history pages, exports, rollup
+# rebuilds) query both tables and merge, attaching the archive as they go;
+# the rest never look at it, and reserve and release never lock it.
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH = 5000  # sessions moved per transaction
+
+COLUMNS = ('id', 'user_id', 'spot_id', 'lot_id', 'vehicle_number', 'entry_time',
+           'exit_time', 'cost', 'overdue_at')
+
+
+def ensure_schema(conn):
+    """Create the archive table in conn's archive file if it isn't there yet."""
+    attach_archive(conn)
+    # Only takes effect while the file is still empty, which is the point:
+    # the archive can give pages back with PRAGMA incremental_vacuum
+    conn.execute('PRAGMA archive.auto_vacuum = INCREMENTAL')
+    conn.execute('PRAGMA archive.journal_mode = WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive.parking_history (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            spot_id INTEGER NOT NULL,
+            lot_id INTEGER NOT NULL,
+            vehicle_number TEXT NOT NULL,
+            entry_time TEXT NOT NULL,
+            exit_time TEXT,
+            cost REAL,
+            overdue_at TEXT
+        )
+    ''')
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS archive.idx_history_entry_time ON parking_history(entry_time)',
+        'CREATE INDEX IF NOT EXISTS archive.idx_history_user_entry ON parking_history(user_id, entry_time)',
+        'CREATE INDEX IF NOT EXISTS archive.idx_history_lot_entry ON parking_history(lot_id, entry_time)',
+    ):
+        conn.execute(statement)
+    conn.commit()
+
+
+def history_tables(conn):
+    """Every table holding parking_history rows for conn's database."""
+    attach_archive(conn)
+    return ['main.parking_history', 'archive.parking_history']
+
+
+def horizon(conn):
+    """entry_time of the newest archived session, or None if nothing is archived."""
+    attach_archive(conn)
+    try:
+        return conn.execute('SELECT MAX(entry_time) FROM archive.parking_history').fetchone()[0]
+    except sqlite3.OperationalError:  # attached, but ensure_schema hasn't run
+        return None
+
+
+def covers(conn, date_from=None):
+    """Whether archived rows can match a query for sessions since date_from."""
+    newest = horizon(conn)
+    if newest is None:
+        return False
+    return date_from is None or date_from.isoformat() <= newest
+
+
+def has_history(conn, lot_id):
+    return any(
+        conn.execute(f'SELECT EXISTS (SELECT 1 FROM {table} WHERE lot_id = ?)', (lot_id,)).fetchone()[0]
+        for table in history_tables(conn)
+    )
+
+
+def _copy_batch(conn, cutoff, batch):
+    ids = [row[0] for row in conn.execute('''
+        SELECT id FROM main.parking_history
+        WHERE entry_time < ? AND exit_time IS NOT NULL
+        ORDER BY entry_time
+        LIMIT ?
+    ''', (cutoff, batch))]
+    if ids:
+        columns = ', '.join(COLUMNS)
+        conn.execute(f'''
+            INSERT OR REPLACE INTO archive.parking_history ({columns})
+            SELECT {columns} FROM main.parking_history
+            WHERE id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(ids),))
+    return ids
+
+
+def _delete_batch(conn, ids):
+    conn.execute('''
+        DELETE FROM main.parking_history
+        WHERE id IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(ids),))
+
+
+def archive_sessions(conn, older_than_days=ARCHIVE_AFTER_DAYS, batch=ARCHIVE_BATCH, now=None):
+    """Move closed sessions that started more than older_than_days ago. Returns the count.
+
+    Each batch is copied in one transaction and deleted from the hot table in
+    the next: commits across two WAL files aren't atomic together, and this
+    order means a crash can only leave a batch in both files (until the next
+    run moves it again), never in neither.
+    """
+    cutoff = ((now or datetime.now()) - timedelta(days=older_than_days)).isoformat()
+    moved = 0
+    while True:
+        ids = booking.run_with_retry(conn, lambda conn: _copy_batch(conn, cutoff, batch))
+        if not ids:
+            return moved
+        booking.run_with_retry(conn, lambda conn: _delete_batch(conn, ids))
+        moved += len(ids)
+
+
+def vacuum(conn, full=False):
+    """Give the hot file's free pages back to the filesystem. Returns pages freed.
+
+    Incremental vacuum only works once the file has auto_vacuum=INCREMENTAL;
+    full=True switches it over with a one-off VACUUM, which rewrites the
+    whole file and needs the database to itself for a while.
+    """
+    before = conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+    if conn.execute('PRAGMA main.auto_vacuum').fetchone()[0] == 2:  # INCREMENTAL
+        conn.execute('PRAGMA main.incremental_vacuum')
+    elif full:
+        conn.execute('PRAGMA main.auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM main')
+    else:
+        return 0
+    return before - conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move old parking history into the archive database.')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    run_parser = subcommands.add_parser('run', help='archive old closed sessions')
+    run_parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                            help='archive sessions that started more than this many days ago')
+    run_parser.add_argument('--batch', type=int, default=ARCHIVE_BATCH, help='sessions per transaction')
+    run_parser.add_argument('--vacuum', action='store_true', help='vacuum the hot database afterwards')
+    vacuum_parser = subcommands.add_parser('vacuum', help='reclaim free pages in the hot database')
+    vacuum_parser.add_argument('--full', action='store_true',
+                               help='run a full VACUUM if incremental vacuum is not enabled yet')
+    args = parser.parse_args()
+
+    conn = connect(archive=True)
+    try:
+        ensure_schema(conn)
+        if args.command == 'run':
+            moved = archive_sessions(conn, args.days, args.batch)
+            print(f"✅ Archived {moved} sessions older than {args.days} days")
+        if args.command == 'vacuum' or args.vacuum:
+            freed = vacuum(conn, full=getattr(args, 'full', False))
+            if freed or conn.execute('PRAGMA main.auto_vacuum').fetchone()[0] == 2:
+                print(f"✅ Freed {freed} pages")
+            else:
+                print("ℹ️ Incremental vacuum is off for this database; run 'python archive.py vacuum --full' once")
+    finally:
+        conn.close()
@@ -0,0 +1,165 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from cache import TTLCache
+
+# Password hashing is deliberately slow (scrypt also takes ~32 MB per hash),
+# so it runs on a small fixed pool: a login flood queues up there instead of
+# pinning every CPU and request thread. Past MAX_PENDING_HASHES waiting
+# jobs, logins are turned away outright.
+HASH_WORKERS = 4
+MAX_PENDING_HASHES = 64
+HASH_TIMEOUT = 10  # seconds
+
+# Sliding windows, checked before the database is touched. Only failed
+# logins count, so many users behind one NAT or proxy address don't lock
+# each other out just by logging in (see PROXY_HOPS in app.py for proxies).
+IP_FAILURES = 30        # failed logins per IP ...
+IP_WINDOW = 60          # ... per this many seconds
+EMAIL_FAILURES = 10     # failed logins per email ...
+EMAIL_WINDOW = 15 * 60  # ... per this many seconds
+
+# Users who logged in recently skip the slow hash when they send the same
+# password again: we keep a keyed digest of it (never the password) next to
+# the stored hash it was checked against.
+VERIFIED_TTL = 10 * 60
+VERIFIED_USERS = 10000
+
+
+class LoginBusy(Exception):
+    """Too many password checks already queued."""
+
+
+class SlidingWindowLimiter:
+    """At most `limit` events per key in any `window` seconds."""
+
+    def __init__(self, limit, window, max_keys=100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._events = {}  # key -> deque of event times, oldest first
+
+    def _prune(self, events, now):
+        while events and events[0] <= now - self.window:
+            events.popleft()
+
+    def retry_after(self, key, now=None):
+        """Seconds until key may act again, or 0 if it's under the limit."""
+        now = now or time.monotonic()
+        with self._lock:
+            events = self._events.get(key)
+            if not events:
+                return 0
+            self._prune(events, now)
+            if len(events) < self.limit:
+                return 0
+            return events[0] + self.window - now
+
+    def record(self, key, now=None):
+        now = now or time.monotonic()
+        with self._lock:
+            events = self._events.get(key)
+            if events is None:
+                if len(self._events) >= self.max_keys:
+                    self._evict(now)
+                events = self._events[key] = deque()
+            self._prune(events, now)
+            events.append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+    def _evict(self, now):
+        # Drop keys with nothing left in their window, then the oldest keys
+        for key in [k for k, events in self._events.items() if events[-1] <= now - self.window]:
+            del self._events[key]
+        while len(self._events) >= self.max_keys:
+            del self._events[next(iter(self._events))]
+
+
+def is_hashed(stored):
+    # werkzeug hashes look like "method$salt$hash"; anything else is a legacy plaintext row
+    return stored.count('$') == 2 and stored.startswith(('scrypt:', 'pbkdf2:'))
+
+
+class Authenticator:
+    def __init__(self, workers=HASH_WORKERS, max_pending=MAX_PENDING_HASHES):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._digest_key = os.urandom(32)
+        self._verified = TTLCache(VERIFIED_TTL, max_entries=VERIFIED_USERS)
+        self._dummy_hash = generate_password_hash(os.urandom(16).hex())
+        self.by_ip = SlidingWindowLimiter(IP_FAILURES, IP_WINDOW)
+        self.by_email = SlidingWindowLimiter(EMAIL_FAILURES, EMAIL_WINDOW)
+
+    def retry_after(self, ip, email):
+        """Seconds the caller has to wait before trying to log in, 0 if they may now."""
+        return max(self.by_ip.retry_after(ip), self.by_email.retry_after(email.lower()))
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy()
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Freed when the hash finishes, not when we stop waiting for it, so
+        # hashes abandoned on timeout still count towards max_pending
+        future.add_done_callback(lambda future: self._slots.release())
+        try:
+            return future.result(timeout=HASH_TIMEOUT)
+        except TimeoutError:
+            raise LoginBusy()
+
+    def hash_password(self, password):
+        return self._run(generate_password_hash, password)
+
+    def _digest(self, password):
+        return hmac.new(self._digest_key, password.encode(), hashlib.sha256).digest()
+
+    def _check(self, user, password):
+        stored = user['password']
+        if not is_hashed(stored):
+            return hmac.compare_digest(stored.encode(), password.encode())
+
+        key = (user['id'], stored)
+        remembered = self._verified.get(key)
+        digest = self._digest(password)
+        if remembered is not None and hmac.compare_digest(remembered, digest):
+            return True
+        if not self._run(check_password_hash, stored, password):
+            return False
+        self._verified.put(key, digest)
+        return True
+
+    def authenticate(self, conn, ip, email, password):
+        """The users row for these credentials, or None. Raises LoginBusy.
+
+        Legacy rows that still hold the plaintext password are rehashed on
+        their first successful login.
+        """
+        user = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+        if user is None:
+            # Take as long as a wrong password would, so unknown emails don't stand out
+            self._run(check_password_hash, self._dummy_hash, password)
+        if user is None or not self._check(user, password):
+            self.by_ip.record(ip)
+            self.by_email.record(email.lower())
+            return None
+
+        if not is_hashed(user['password']):
+            conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?',
+                         (self.hash_password(password), user['id'], user['password']))
+            conn.commit()
+        self.by_email.reset(email.lower())
+        return user
@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+import uuid
+
+# Rebuild a cached payload at least this often even if no write in this
+# process bumped it, to pick up writes handled by other worker processes.
+REVALIDATE_AFTER = 5  # seconds
+
+LOT_FIELDS = ('id', 'name', 'address', 'pin_code', 'total_spots', 'available_spots',
+              'base_price', 'base_duration', 'extra_hour_price')
+
+
+class AvailabilityFeed:
+    """Versioned JSON snapshots of lot availability for polling clients.
+
+    Every lot has a version number, bumped by the write paths. A payload's
+    ETag is derived from those versions, so a poll with a matching
+    If-None-Match can be answered 304 from memory. The epoch changes on every
+    restart so ETags from an old process never match.
+    """
+
+    def __init__(self, revalidate_after=REVALIDATE_AFTER):
+        self.revalidate_after = revalidate_after
+        self._lock = threading.Lock()
+        self._epoch = uuid.uuid4().hex[:8]
+        self._seq = 0           # latest version handed out to any lot
+        self._versions = {}     # lot_id -> version
+        self._cached = {}       # lot_id or None (all lots) -> (version, body, checked_at)
+
+    def bump(self, lot_id=None):
+        """Mark lot_id as changed; None means the set of lots itself changed."""
+        with self._lock:
+            self._seq += 1
+            if lot_id is not None:
+                self._versions[lot_id] = self._seq
+
+    def _version(self, lot_id):
+        if lot_id is None:
+            return self._seq
+        return self._versions.get(lot_id, 0)
+
+    def etag(self, version):
+        return f'{self._epoch}-{version}'
+
+    def current_etag(self, lot_id=None):
+        """The ETag a fresh payload would have, without touching the database."""
+        with self._lock:
+            cached = self._cached.get(lot_id)
+            if cached is None or cached[0] != self._version(lot_id):
+                return None
+            if time.monotonic() - cached[2] > self.revalidate_after:
+                return None
+            return self.etag(cached[0])
+
+    def payload(self, lot_id, loader):
+        """Returns (etag, body) for lot_id (None for every lot), loading if needed.
+
+        loader() returns the rows to serialise. If the rows turn out unchanged
+        after a revalidation, the old ETag is kept so clients still get 304s.
+        """
+        with self._lock:
+            version = self._version(lot_id)
+            cached = self._cached.get(lot_id)
+            if (cached is not None and cached[0] == version
+                    and time.monotonic() - cached[2] <= self.revalidate_after):
+                return self.etag(version), cached[1]
+
+        rows = loader()
+        if lot_id is None:
+            data = {'lots': [_lot_dict(row) for row in rows]}
+        else:
+            data = {'lot': _lot_dict(rows[0])} if rows else None
+        body = json.dumps(data, separators=(',', ':')).encode() if data else None
+
+        with self._lock:
+            if self._version(lot_id) != version:
+                # A write landed while loading; the body may or may not include
+                # it, so don't cache it or give it an ETag
+                return None, body
+
+            if cached is not None and cached[0] == version and cached[1] != body:
+                # Changed by another worker process: needs a version of its own
+                self._seq += 1
+                version = self._seq
+                if lot_id is not None:
+                    self._versions[lot_id] = version
+
+            self._cached[lot_id] = (version, body, time.monotonic())
+        return self.etag(version), body
+
+
+def _lot_dict(row):
+    return {field: row[field] for field in LOT_FIELDS}
@@ -0,0 +1,193 @@
+"""Contention benchmark for the reserve/release path.
+
+Builds a throwaway database, then has many worker threads hammer
+/reserve/<lot_id> and /release through the Flask test client, each worker
+acting as its own user. Afterwards the database is checked for invariant
+violations (double-booked spots, users holding two spots, drifted
+available_spots counters).
+
+    python bench/contention.py --workers 64 --iterations 50 --lots 2 --spots 20
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def setup_database(lots, spots, workers):
+    from migrations import migrate
+
+    migrate()
+
+    conn = sqlite3.connect('parking.db')
+    lot_ids = []
+    for n in range(lots):
+        cur = conn.execute('''
+            INSERT INTO parking_lots (name, address, pin_code, total_spots, available_spots)
+            VALUES (?, ?, ?, ?, 0)
+        ''', (f'Bench Lot {n}', 'Bench Street', '000000', spots))
+        lot_ids.append(cur.lastrowid)
+        conn.executemany(
+            'INSERT INTO parking_spots (lot_id, spot_number) VALUES (?, ?)',
+            ((cur.lastrowid, f'Spot-{i}') for i in range(1, spots + 1))
+        )
+
+    user_ids = []
+    for n in range(workers):
+        cur = conn.execute('''
+            INSERT INTO users (email, password, full_name, role)
+            VALUES (?, ?, ?, 'user')
+        ''', (f'bench{n}@example.com', 'bench', f'Bench User {n}'))
+        user_ids.append(cur.lastrowid)
+
+    conn.commit()
+    conn.close()
+    return lot_ids, user_ids
+
+
+def check_invariants(db_path):
+    conn = sqlite3.connect(db_path)
+    violations = []
+
+    for spot_id, open_sessions in conn.execute('''
+        SELECT spot_id, COUNT(*) FROM parking_history
+        WHERE exit_time IS NULL
+        GROUP BY spot_id HAVING COUNT(*) > 1
+    '''):
+        violations.append(f'spot {spot_id} has {open_sessions} open sessions')
+
+    for user_id, held in conn.execute('''
+        SELECT current_user_id, COUNT(*) FROM parking_spots
+        WHERE current_user_id IS NOT NULL
+        GROUP BY current_user_id HAVING COUNT(*) > 1
+    '''):
+        violations.append(f'user {user_id} holds {held} spots')
+
+    for spot_id, in conn.execute('''
+        SELECT s.id FROM parking_spots s
+        WHERE s.is_occupied = 1 AND NOT EXISTS (
+            SELECT 1 FROM parking_history h
+            WHERE h.spot_id = s.id AND h.exit_time IS NULL
+        )
+    '''):
+        violations.append(f'spot {spot_id} is occupied without an open session')
+
+    for lot_id, counter, actual in conn.execute('''
+        SELECT l.id, l.available_spots,
+               (SELECT COUNT(*) FROM parking_spots s WHERE s.lot_id = l.id AND s.is_occupied = 0)
+        FROM parking_lots l
+    '''):
+        if counter != actual:
+            violations.append(f'lot {lot_id} available_spots={counter} but {actual} spots are free')
+
+    conn.close()
+    return violations
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='parking-bench-')
+    os.chdir(workdir)
+
+    lot_ids, user_ids = setup_database(args.lots, args.spots, args.workers)
+
+    from app import app
+    app.config['TESTING'] = True
+
+    latencies = {'reserve': [], 'release': []}
+    outcomes = {'reserved': 0, 'full': 0, 'already': 0, 'released': 0, 'errors': 0}
+    stats_lock = threading.Lock()
+    start_gate = threading.Barrier(args.workers)
+
+    def worker(user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user'] = {'id': user_id, 'role': 'user'}
+            sess['id'] = user_id
+            sess['role'] = 'user'
+        rng = random.Random(user_id)
+        local = {'reserve': [], 'release': []}
+        local_outcomes = dict.fromkeys(outcomes, 0)
+
+        start_gate.wait()
+        for _ in range(args.iterations):
+            lot_id = rng.choice(lot_ids)
+            t0 = time.perf_counter()
+            response = client.post(f'/reserve/{lot_id}', data={'vehicle_number': f'BENCH{user_id:06d}'})
+            local['reserve'].append(time.perf_counter() - t0)
+            if response.status_code == 302:
+                local_outcomes['reserved'] += 1
+            elif b'No available spots' in response.data:
+                local_outcomes['full'] += 1
+            elif b'already have an active reservation' in response.data:
+                local_outcomes['already'] += 1
+            else:
+                local_outcomes['errors'] += 1
+
+            t0 = time.perf_counter()
+            response = client.post('/release')
+            local['release'].append(time.perf_counter() - t0)
+            if response.status_code == 302:
+                local_outcomes['released'] += 1
+            else:
+                local_outcomes['errors'] += 1
+
+        with stats_lock:
+            for key in latencies:
+                latencies[key].extend(local[key])
+            for key in outcomes:
+                outcomes[key] += local_outcomes[key]
+
+    threads = [threading.Thread(target=worker, args=(user_id,)) for user_id in user_ids]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - t0
+
+    total_requests = sum(len(v) for v in latencies.values())
+    print(f'database:    {os.path.join(workdir, "parking.db")}')
+    print(f'workers:     {args.workers} x {args.iterations} iterations, '
+          f'{args.lots} lots x {args.spots} spots')
+    print(f'requests:    {total_requests} in {elapsed:.2f}s ({total_requests / elapsed:.0f} req/s)')
+    for key, values in latencies.items():
+        print(f'{key:<12} p50={percentile(values, 50) * 1000:.2f}ms '
+              f'p99={percentile(values, 99) * 1000:.2f}ms max={max(values) * 1000:.2f}ms')
+    print('outcomes:    ' + ', '.join(f'{k}={v}' for k, v in outcomes.items()))
+
+    violations = check_invariants('parking.db')
+    if violations:
+        print(f'invariant violations: {len(violations)}')
+        for violation in violations[:20]:
+            print(f'  - {violation}')
+        return 1
+    print('invariant violations: 0')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--lots', type=int, default=2)
+    parser.add_argument('--spots', type=int, default=16)
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""Seeded synthetic database generator.
+
+Builds a parking.db-compatible database with --lots lots holding --spots
+spots between them, --users users and --history closed parking sessions
+spread over the --days days before --end. On top of that, --occupancy of
+the spots are currently taken by open sessions. The same arguments always
+produce the same database.
+
+Entries cluster around a morning and an evening peak, weekends are quieter,
+stays are log-normal (median about 1.5 hours, capped at a day), and a
+minority of users and lots take most of the traffic.
+
+    python bench/generate.py --out bench/data/large.db --history 20000000
+"""
+import argparse
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HISTORY_BATCH = 100000  # sessions per INSERT batch / commit
+
+FIRST_NAMES = ('Aarav', 'Vivaan', 'Aditya', 'Ananya', 'Diya', 'Isha', 'Kabir', 'Meera',
+               'Rohan', 'Saanvi', 'Arjun', 'Priya', 'Neha', 'Rahul', 'Sakshi', 'Vikram')
+LAST_NAMES = ('Sharma', 'Patel', 'Reddy', 'Iyer', 'Gupta', 'Nair', 'Singh', 'Mehta',
+              'Joshi', 'Kulkarni', 'Das', 'Shah', 'Rao', 'Verma', 'Kapoor', 'Bose')
+# (city, pin code prefix, state code used on number plates)
+CITIES = (('Bengaluru', '560', 'KA'), ('Mumbai', '400', 'MH'), ('Delhi', '110', 'DL'),
+          ('Ahmedabad', '380', 'GJ'), ('Chennai', '600', 'TN'), ('Hyderabad', '500', 'TS'),
+          ('Pune', '411', 'MH'), ('Kolkata', '700', 'WB'))
+STREETS = ('MG Road', 'Station Road', 'Ring Road', 'Market Street', 'Lake View', 'Tech Park')
+
+
+def plate(rng, state):
+    return (f'{state}{rng.randint(1, 99):02d}'
+            f'{chr(rng.randint(65, 90))}{chr(rng.randint(65, 90))}{rng.randint(1, 9999):04d}')
+
+
+def popularity(rng, n, alpha=1.5):
+    """Cumulative weights for a skewed (Pareto) popularity over n items."""
+    total = 0.0
+    cumulative = []
+    for _ in range(n):
+        total += rng.paretovariate(alpha)
+        cumulative.append(total)
+    return cumulative
+
+
+def entry_offset(rng, days):
+    """Seconds before the end of the window at which a session starts."""
+    while True:
+        day = rng.randrange(1, days + 1)
+        weekday = (days - day) % 7
+        if weekday < 5 or rng.random() < 0.6:  # weekends ~40% quieter
+            break
+    peak = rng.random()
+    if peak < 0.4:
+        hour = rng.gauss(9, 1.5)
+    elif peak < 0.75:
+        hour = rng.gauss(18, 2)
+    else:
+        hour = rng.uniform(6, 23)
+    hour = min(max(hour, 0), 23.99)
+    return day * 86400 - int(hour * 3600)
+
+
+def stay_seconds(rng):
+    hours = math.exp(rng.gauss(math.log(1.5), 0.8))
+    return int(min(hours, 24) * 3600) + 60
+
+
+def create_lots(conn, rng, lots, spots):
+    import provisioning
+
+    # Split the spots over the lots unevenly: some lots are much bigger
+    weights = [rng.uniform(0.3, 1.7) for _ in range(lots)]
+    scale = spots / sum(weights)
+    sizes = [max(1, int(w * scale)) for w in weights]
+    sizes[-1] = max(1, sizes[-1] + spots - sum(sizes))
+
+    created = []
+    for n, size in enumerate(sizes):
+        city, pin_prefix, _ = rng.choice(CITIES)
+        lot_id = provisioning.create_lot(
+            conn, f'{city} Parking {n + 1}', f'{rng.randint(1, 300)} {rng.choice(STREETS)}, {city}',
+            f'{pin_prefix}{rng.randint(1, 99):03d}', size,
+            base_price=rng.choice((40, 60, 80, 100, 120)),
+            base_duration=rng.choice((1, 2, 2, 3)),
+            extra_hour_price=rng.choice((20, 30, 50, 75)),
+        )
+        first_spot = conn.execute(
+            'SELECT MIN(id) FROM parking_spots WHERE lot_id = ?', (lot_id,)
+        ).fetchone()[0]
+        created.append((lot_id, first_spot, size))
+    conn.commit()
+    return created
+
+
+def create_users(conn, rng, users):
+    rows = []
+    for n in range(users):
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        city, pin_prefix, _ = rng.choice(CITIES)
+        rows.append((f'user{n}@example.com', 'password', name, city,
+                     f'{pin_prefix}{rng.randint(1, 99):03d}'))
+    conn.executemany('''
+        INSERT INTO users (email, password, full_name, address, pin_code, role)
+        VALUES (?, ?, ?, ?, ?, 'user')
+    ''', rows)
+    conn.commit()
+
+    # Most users drive one vehicle, some two or three
+    vehicles = []
+    for (user_id,) in conn.execute("SELECT id FROM users WHERE role = 'user' ORDER BY id"):
+        state = rng.choice(CITIES)[2]
+        count = rng.choices((1, 2, 3), weights=(80, 15, 5))[0]
+        vehicles.append((user_id, [plate(rng, state) for _ in range(count)]))
+    return vehicles
+
+
+def create_history(conn, rng, lots, vehicles, sessions, days, end):
+    import tariff
+
+    tariffs = {row[0]: row[1:] for row in conn.execute(
+        'SELECT id, base_price, base_duration, extra_hour_price FROM parking_lots'
+    )}
+    user_weights = popularity(rng, len(vehicles))
+    lot_weights = popularity(rng, len(lots), alpha=2.0)
+
+    written = 0
+    while written < sessions:
+        batch = min(HISTORY_BATCH, sessions - written)
+        drivers = rng.choices(vehicles, cum_weights=user_weights, k=batch)
+        places = rng.choices(lots, cum_weights=lot_weights, k=batch)
+
+        rows = []
+        for (user_id, plates), (lot_id, first_spot, size) in zip(drivers, places):
+            entry = end - timedelta(seconds=entry_offset(rng, days))
+            exit_ = min(entry + timedelta(seconds=stay_seconds(rng)), end)
+            rows.append((user_id, first_spot + rng.randrange(size), lot_id,
+                         rng.choice(plates), entry, exit_))
+
+        prices = [tariffs[row[2]] for row in rows]
+        costs = tariff.costs(
+            [(row[5] - row[4]).total_seconds() / 3600 for row in rows],
+            [p[0] for p in prices], [p[1] for p in prices], [p[2] for p in prices],
+        )
+        conn.executemany('''
+            INSERT INTO parking_history (user_id, spot_id, lot_id, vehicle_number, entry_time, exit_time, cost)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', ((u, s, l, v, entry.isoformat(), exit_.isoformat(), cost)
+              for (u, s, l, v, entry, exit_), cost in zip(rows, costs)))
+        conn.commit()
+        written += batch
+        print(f'  {written:,}/{sessions:,} sessions', end='\r', flush=True)
+    print()
+
+
+def occupy_spots(conn, rng, lots, vehicles, occupancy, end):
+    """Park a random driver in `occupancy` of the spots, with open sessions."""
+    drivers = list(vehicles)
+    rng.shuffle(drivers)
+    taken = 0
+    for lot_id, first_spot, size in lots:
+        count = min(int(size * occupancy), len(drivers))
+        for spot_id in rng.sample(range(first_spot, first_spot + size), count):
+            user_id, plates = drivers.pop()
+            vehicle = rng.choice(plates)
+            entry = (end - timedelta(seconds=rng.randint(60, 6 * 3600))).isoformat()
+            conn.execute('''
+                UPDATE parking_spots SET is_occupied = 1, current_user_id = ? WHERE id = ?
+            ''', (user_id, spot_id))
+            conn.execute('''
+                INSERT INTO parking_history (user_id, spot_id, lot_id, vehicle_number, entry_time)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, spot_id, lot_id, vehicle, entry))
+            conn.execute('''
+                INSERT INTO reservations (user_id, spot_id, vehicle_number, booking_time)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, spot_id, vehicle, entry))
+        taken += count
+    conn.commit()
+    return taken
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', default=os.path.join(ROOT, 'bench', 'data', 'parking.db'))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--lots', type=int, default=50)
+    parser.add_argument('--spots', type=int, default=10000, help='total spots over all lots')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--history', type=int, default=1000000, help='closed sessions')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--occupancy', type=float, default=0.6, help='fraction of spots in use now')
+    parser.add_argument('--end', default=datetime.now().strftime('%Y-%m-%d'),
+                        help='closed sessions end by midnight of this day (YYYY-MM-DD)')
+    parser.add_argument('--force', action='store_true', help='overwrite --out if it exists')
+    args = parser.parse_args()
+
+    if os.path.exists(args.out):
+        if not args.force:
+            parser.error(f'{args.out} exists (use --force to overwrite)')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.out + suffix):
+                os.remove(args.out + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+
+    # db.DATABASE is read at import time
+    os.environ['PARKING_DB'] = args.out
+    import rollups
+    from migrations import migrate
+
+    started = time.perf_counter()
+    rng = random.Random(args.seed)
+    end = datetime.fromisoformat(args.end)
+    migrate()
+
+    conn = sqlite3.connect(args.out)
+    # Nothing to protect until the file is finished
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -200000')
+
+    conn.execute('''
+        INSERT INTO users (email, password, full_name, role)
+        VALUES ('admin@admin.com', 'admin123', 'Admin User', 'admin')
+    ''')
+    lots = create_lots(conn, rng, args.lots, args.spots)
+    print(f'✅ {len(lots)} lots, {args.spots:,} spots')
+    vehicles = create_users(conn, rng, args.users)
+    print(f'✅ {len(vehicles):,} users')
+    create_history(conn, rng, lots, vehicles, args.history, args.days, end)
+    taken = occupy_spots(conn, rng, lots, vehicles, args.occupancy, end)
+    print(f'✅ {args.history:,} closed sessions, {taken:,} open')
+
+    conn.execute('BEGIN')
+    rollups.rebuild(conn)
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.close()
+
+    size = os.path.getsize(args.out) / 1e6
+    print(f'✅ Wrote {args.out} ({size:,.0f} MB) in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Spot provisioning benchmark.
+
+Times creating one lot with --spots spots the old way (one INSERT per spot
+from a Python loop) and through provisioning.create_lot, then imports a CSV
+of --csv-lots lots through provisioning.import_lots_csv.
+
+    python bench/provision.py --spots 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def per_row_insert(conn, total_spots):
+    # What create_lot/add_lot used to do; available_spots is counted by trigger
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO parking_lots (name, address, pin_code, total_spots, available_spots)
+        VALUES (?, ?, ?, ?, 0)
+    ''', ('Per-row Lot', 'Bench Street', '000000', total_spots))
+    lot_id = cursor.lastrowid
+    for i in range(1, total_spots + 1):
+        cursor.execute('''
+            INSERT INTO parking_spots (lot_id, spot_number)
+            VALUES (?, ?)
+        ''', (lot_id, f"Spot-{i}"))
+    conn.commit()
+
+
+def bulk_insert(conn, total_spots):
+    import provisioning
+
+    provisioning.create_lot(conn, 'Bulk Lot', 'Bench Street', '000000', total_spots)
+    conn.commit()
+
+
+def csv_import(conn, lots, spots_per_lot):
+    import provisioning
+
+    def rows():
+        yield 'name,address,pin_code,total_spots,base_price,base_duration,extra_hour_price\n'
+        for n in range(lots):
+            yield f'Imported Lot {n},Bench Street {n},{560000 + n % 100},{spots_per_lot},80,2,50\n'
+
+    return provisioning.import_lots_csv(conn, rows())
+
+
+def report(label, spots, seconds):
+    print(f'{label:<16} {spots:>9} spots in {seconds:7.3f}s  {spots / seconds:>12,.0f} spots/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--spots', type=int, default=100000)
+    parser.add_argument('--csv-lots', type=int, default=200)
+    parser.add_argument('--csv-spots', type=int, default=500, help='spots per imported lot')
+    parser.add_argument('--skip-per-row', action='store_true')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='parking-bench-'))
+    from db import connect
+    from migrations import migrate
+
+    migrate()
+    conn = connect()
+
+    if not args.skip_per_row:
+        t0 = time.perf_counter()
+        per_row_insert(conn, args.spots)
+        report('per-row', args.spots, time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    bulk_insert(conn, args.spots)
+    report('bulk', args.spots, time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    lots, spots, _, _ = csv_import(conn, args.csv_lots, args.csv_spots)
+    report(f'csv ({lots} lots)', spots, time.perf_counter() - t0)
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""Route-level benchmark.
+
+Drives the main routes of app.py through the Flask test client against a
+copy of a generated database (see bench/generate.py), recording latency
+percentiles and the number of SQL statements each request ran. Results are
+saved as JSON; --compare prints the difference between two result files.
+
+    python bench/generate.py --out bench/data/parking.db
+    python bench/routes.py --db bench/data/parking.db --requests 200
+    python bench/routes.py --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from contention import percentile  # noqa: E402
+
+
+class QueryCounter:
+    """Counts statements run on any connection, from the benchmark thread only."""
+
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.count = 0
+
+    def install(self, conn):
+        conn.set_trace_callback(self._trace)
+
+    def _trace(self, statement):
+        # Statements run by triggers are reported with a leading comment
+        if threading.get_ident() == self.thread and not statement.startswith('--'):
+            self.count += 1
+
+
+def pick_users(conn, rng, count):
+    """Users holding no spot, weighted towards ones with history (like real traffic)."""
+    rows = conn.execute('''
+        SELECT h.user_id, COUNT(*) AS sessions
+        FROM parking_history h
+        JOIN users u ON h.user_id = u.id
+        WHERE u.role = 'user' AND h.user_id NOT IN (
+            SELECT current_user_id FROM parking_spots WHERE current_user_id IS NOT NULL
+        )
+        GROUP BY h.user_id
+    ''').fetchall()
+    if not rows:
+        rows = conn.execute('''
+            SELECT id, 1 FROM users WHERE role = 'user' AND id NOT IN (
+                SELECT current_user_id FROM parking_spots WHERE current_user_id IS NOT NULL
+            )
+        ''').fetchall()
+    if not rows:
+        sys.exit('no free users in the database; generate one with bench/generate.py')
+    sample = rng.sample(rows, min(count, len(rows)))
+    return [row[0] for row in sample]
+
+
+def login_as(app, user_id, role):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user'] = {'id': user_id, 'role': role}
+        sess['id'] = user_id
+        sess['role'] = role
+        sess['full_name'] = f'Bench {role} {user_id}'
+    return client
+
+
+def scenarios(app, conn, rng, users):
+    """(name, function returning a response) pairs, one per benchmarked route."""
+    import app as web
+
+    admin_id = conn.execute("SELECT id FROM users WHERE role = 'admin'").fetchone()[0]
+    admin = login_as(app, admin_id, 'admin')
+    clients = [login_as(app, user_id, 'user') for user_id in users]
+    lot_ids = [row[0] for row in conn.execute('SELECT id FROM parking_lots WHERE available_spots > 0')]
+    plates = [row[0] for row in conn.execute(
+        'SELECT vehicle_number FROM user_vehicles ORDER BY id LIMIT 10000'
+    )]
+    plates = rng.sample(plates, min(200, len(plates)))
+
+    # Routes run one after another: every reserve goes to a different user,
+    # then release walks the same users in the same order
+    reserved, released = [], []
+
+    def reserve():
+        n = len(reserved) % len(clients)
+        reserved.append(n)
+        return clients[n].post(f'/reserve/{rng.choice(lot_ids)}', data={'vehicle_number': f'BENCH{n:05d}'})
+
+    def release():
+        n = reserved[len(released) % len(reserved)]
+        released.append(n)
+        return clients[n].post('/release')
+
+    def as_user(path):
+        return lambda: rng.choice(clients).get(path)
+
+    def admin_dashboard_cold():
+        web.dashboard_cache.clear()
+        return admin.get('/admin_dashboard')
+
+    def vehicle_search():
+        plate = rng.choice(plates)
+        start = rng.randrange(max(1, len(plate) - 4))
+        return admin.get('/admin/vehicles', query_string={'search': plate[start:start + 4]})
+
+    return [
+        ('reserve', reserve),
+        ('release_spot', release),
+        ('user_dashboard', as_user('/user_dashboard')),
+        ('user_history', as_user('/user_history')),
+        ('admin_dashboard', lambda: admin.get('/admin_dashboard')),
+        ('admin_dashboard_cold', admin_dashboard_cold),
+        ('admin_reservations', lambda: admin.get('/admin/reservations')),
+        ('admin_reservations_lot', lambda: admin.get('/admin/reservations',
+                                                     query_string={'lot_id': rng.choice(lot_ids)})),
+        ('admin_analytics', lambda: admin.get('/admin/analytics')),
+        ('admin_vehicles_search', vehicle_search),
+        ('admin_vehicles', lambda: admin.get('/admin/vehicles')),
+        ('api_lots', lambda: admin.get('/api/lots')),
+    ]
+
+
+def summarize(latencies, queries, statuses):
+    return {
+        'requests': len(latencies),
+        'statuses': statuses,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 90) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+        'queries_mean': round(sum(queries) / len(queries), 2),
+        'queries_max': max(queries),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='parking-routes-')
+    db_path = os.path.join(workdir, 'parking.db')
+    # Work on a copy: reserve/release write to it
+    source = sqlite3.connect(args.db)
+    target = sqlite3.connect(db_path)
+    source.backup(target)
+    source.close()
+    target.close()
+
+    os.chdir(workdir)
+    os.environ['PARKING_DB'] = db_path
+
+    counter = QueryCounter()
+    import db
+    db.add_connect_hook(counter.install)
+
+    import app as web
+    web.app.config['TESTING'] = True
+    # Keep background writes and snapshot copies out of the measurements;
+    # the report routes then read the live database
+    for job in web.overdue_schedulers + web.auto_checkout_schedulers + web.replicas:
+        job.stop()
+
+    conn = db.connect()
+    rng = random.Random(args.seed)
+    # reserve needs a fresh user per request
+    users = pick_users(conn, rng, max(args.users, args.requests + args.warmup))
+    meta = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'database': os.path.abspath(args.db),
+        'history_rows': conn.execute('SELECT COUNT(*) FROM parking_history').fetchone()[0],
+        'lots': conn.execute('SELECT COUNT(*) FROM parking_lots').fetchone()[0],
+        'users': conn.execute('SELECT COUNT(*) FROM users').fetchone()[0],
+        'requests_per_route': args.requests,
+        'seed': args.seed,
+    }
+    routes = scenarios(web.app, conn, rng, users)
+    conn.close()
+
+    if args.only:
+        routes = [(name, fn) for name, fn in routes if name in args.only]
+
+    results = {}
+    for name, fn in routes:
+        for _ in range(args.warmup):
+            fn()
+        latencies, queries, statuses = [], [], {}
+        for _ in range(args.requests):
+            counter.count = 0
+            t0 = time.perf_counter()
+            response = fn()
+            latencies.append(time.perf_counter() - t0)
+            queries.append(counter.count)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        results[name] = summarize(latencies, queries, statuses)
+        r = results[name]
+        print(f'{name:<24} p50={r["p50_ms"]:9.2f}ms p99={r["p99_ms"]:9.2f}ms '
+              f'queries={r["queries_mean"]:6.1f}  {statuses}')
+
+    out = args.out or os.path.join(
+        ROOT, 'bench', 'results', f'routes-{datetime.now():%Y%m%d-%H%M%S}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({'meta': meta, 'routes': results}, f, indent=2)
+    print(f'✅ Results written to {out}')
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)['routes']
+    with open(after_path) as f:
+        after = json.load(f)['routes']
+
+    def change(old, new):
+        return f'{(new - old) / old * 100:+6.1f}%' if old else '    n/a'
+
+    print(f'{"route":<24} {"p50 before":>11} {"after":>9} {"":>7}  {"p99 before":>11} {"after":>9} {"":>7}  queries')
+    for name in before:
+        if name not in after:
+            continue
+        b, a = before[name], after[name]
+        print(f'{name:<24} {b["p50_ms"]:9.2f}ms {a["p50_ms"]:7.2f}ms {change(b["p50_ms"], a["p50_ms"])}  '
+              f'{b["p99_ms"]:9.2f}ms {a["p99_ms"]:7.2f}ms {change(b["p99_ms"], a["p99_ms"])}  '
+              f'{b["queries_mean"]:.1f} -> {a["queries_mean"]:.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=os.path.join(ROOT, 'bench', 'data', 'parking.db'),
+                        help='database to benchmark against (copied first)')
+    parser.add_argument('--requests', type=int, default=100, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per route')
+    parser.add_argument('--users', type=int, default=50, help='distinct users to act as')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', nargs='+', metavar='ROUTE', help='only run these routes')
+    parser.add_argument('--out', help='results file (default bench/results/routes-<time>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='compare two results files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if not os.path.exists(args.db):
+        parser.error(f'{args.db} not found; create it with bench/generate.py')
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
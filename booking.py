@@ -0,0 +1,180 @@
+import random
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import rollups
+import tariff
+
+
+Reservation = namedtuple('Reservation', 'spot_id history_id lot_id entry_time')
+
+
+class ReservationError(Exception):
+    pass
+
+
+class AlreadyReserved(ReservationError):
+    pass
+
+
+class NoSpotAvailable(ReservationError):
+    pass
+
+
+BUSY_RETRIES = 8
+BUSY_BASE_DELAY = 0.005  # seconds, doubled on every retry
+BUSY_MAX_DELAY = 0.25
+
+
+def is_busy(error):
+    name = getattr(error, 'sqlite_errorname', None)
+    if name:
+        return name.startswith('SQLITE_BUSY') or name.startswith('SQLITE_LOCKED')
+    message = str(error)
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def run_with_retry(conn, work, retries=BUSY_RETRIES):
+    """Run work(conn) inside BEGIN IMMEDIATE, retrying with backoff on SQLITE_BUSY.
+
+    BEGIN IMMEDIATE takes the write lock up front, so everything work() reads
+    is still true when it writes. Any exception rolls the transaction back.
+    """
+    for attempt in range(retries + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = work(conn)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if not is_busy(e) or attempt == retries:
+                raise
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+        # Exponential backoff with full jitter so retrying workers spread out
+        delay = min(BUSY_MAX_DELAY, BUSY_BASE_DELAY * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+
+
+def reserve_spot(conn, allocator, lot_id, user_id, vehicle_number):
+    """Atomically give user_id a free spot in lot_id. Returns a Reservation."""
+    taken = []
+
+    def work(conn):
+        # A busy retry: the last attempt's spot was rolled back, so it is free again
+        for spot_id in taken:
+            allocator.release(lot_id, spot_id)
+        taken.clear()
+
+        active = conn.execute('''
+            SELECT 1 FROM parking_spots
+            WHERE current_user_id = ? AND is_occupied = 1
+        ''', (user_id,)).fetchone()
+        if active:
+            raise AlreadyReserved()
+
+        verified = False
+        while True:
+            spot_id = allocator.acquire(conn, lot_id)
+            if spot_id is None:
+                if not verified and allocator.verify(conn, lot_id):
+                    # The table had free spots the allocator didn't know about
+                    verified = True
+                    continue
+                raise NoSpotAvailable()
+
+            # Only claim the spot if nobody else did in the meantime
+            claimed = conn.execute('''
+                UPDATE parking_spots
+                SET is_occupied = 1, current_user_id = ?
+                WHERE id = ? AND is_occupied = 0
+            ''', (user_id, spot_id)).rowcount
+            if claimed:
+                taken.append(spot_id)
+                break
+
+        now = datetime.now().isoformat()
+        history_id = conn.execute('''
+            INSERT INTO parking_history (user_id, spot_id, lot_id, vehicle_number, entry_time)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, spot_id, lot_id, vehicle_number, now)).lastrowid
+        rollups.record_entry(conn, lot_id, now)
+
+        # Insert into reservations table so history shows up
+        conn.execute('''
+            INSERT INTO reservations (user_id, spot_id, vehicle_number, booking_time)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, spot_id, vehicle_number, now))
+
+        return Reservation(spot_id, history_id, lot_id, now)
+
+    try:
+        return run_with_retry(conn, work)
+    except BaseException:
+        # The transaction was rolled back, so the spot is free again
+        for spot_id in taken:
+            allocator.release(lot_id, spot_id)
+        raise
+
+
+def release_spot(conn, allocator, user_id, charge=True):
+    """Free the spot held by user_id and close its parking_history row.
+
+    Returns (spot, cost), or None if the user holds no spot. cost is None
+    when charge is False or the session has no entry time.
+    """
+    def work(conn):
+        spot = conn.execute(
+            'SELECT * FROM parking_spots WHERE current_user_id = ?', (user_id,)
+        ).fetchone()
+        if not spot:
+            return None
+
+        now = datetime.now()
+
+        history = conn.execute('''
+            SELECT ph.id, ph.entry_time, pl.base_price, pl.base_duration, pl.extra_hour_price
+            FROM parking_history ph
+            JOIN parking_lots pl ON ph.lot_id = pl.id
+            WHERE ph.user_id = ? AND ph.spot_id = ? AND ph.exit_time IS NULL
+        ''', (user_id, spot['id'])).fetchone()
+
+        cost = None
+        if charge and history and history['entry_time']:
+            cost = tariff.cost(tariff.duration_hours(history['entry_time'], now),
+                               history['base_price'], history['base_duration'],
+                               history['extra_hour_price'])
+
+        # Mark spot as free, unless a concurrent release already did; the
+        # lot's available_spots follows by trigger
+        freed = conn.execute('''
+            UPDATE parking_spots
+            SET is_occupied = 0, current_user_id = NULL
+            WHERE id = ? AND current_user_id = ?
+        ''', (spot['id'], user_id)).rowcount
+        if not freed:
+            return None
+
+        # Update parking history with exit time & cost
+        if history:
+            conn.execute('''
+                UPDATE parking_history
+                SET exit_time = ?, cost = ?
+                WHERE id = ?
+            ''', (now.isoformat(), cost, history['id']))
+            rollups.record_exit(conn, spot['lot_id'], history['entry_time'], now, cost)
+
+        return spot, cost
+
+    result = run_with_retry(conn, work)
+    if result:
+        spot, _ = result
+        allocator.release(spot['lot_id'], spot['id'])
+    return result
@@ -0,0 +1,93 @@
+import threading
+import time
+
+
+class TTLCache:
+    """A small in-process cache where every entry expires after `ttl` seconds.
+
+    Writers call invalidate()/clear() when they change the underlying data;
+    the TTL bounds how stale other worker processes (which don't see those
+    calls) can get. With max_entries set, the oldest entries are dropped to
+    make room, for caches keyed by something unbounded like user id.
+    """
+
+    def __init__(self, ttl, max_entries=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (expires_at, value)
+        self._generation = 0  # bumped on every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def update(self, key, change):
+        """Replace a live entry with change(entry); missing or expired keys stay missing."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries[key] = (entry[0], change(entry[1]))
+
+    def _store(self, key, value):
+        self._entries.pop(key, None)  # re-insert at the end: dicts keep insertion order
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        if self.max_entries is not None:
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        # Load outside the lock so a slow query doesn't block other keys
+        value = loader()
+        with self._lock:
+            # Don't store a value that was invalidated while it was loading
+            if generation == self._generation:
+                self._store(key, value)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            self._generation += 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'ttl_seconds': self.ttl,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,175 @@
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import booking
+import rollups
+import tariff
+from db import connect
+
+log = logging.getLogger(__name__)
+
+# Sessions nobody released (the driver forgot, or never came back to log
+# out) are closed in bulk: every open session that started more than
+# AUTO_CHECKOUT_AFTER_HOURS ago is checked out as of now and billed under its
+# lot's tariff. Each batch is a handful of set-based statements in one
+# transaction, however many sessions it closes.
+AUTO_CHECKOUT_AFTER_HOURS = 24
+CHECKOUT_BATCH = 2000  # sessions closed per transaction
+CHECKOUT_INTERVAL = 15 * 60  # seconds between scheduled runs
+
+CheckoutResult = namedtuple('CheckoutResult', 'sessions spots_freed revenue seconds')
+
+
+def _checkout_batch(conn, cutoff, now, batch):
+    # idx_history_open: only open sessions are read
+    sessions = conn.execute('''
+        SELECT h.id, h.user_id, h.spot_id, h.lot_id, h.entry_time,
+               l.base_price, l.base_duration, l.extra_hour_price
+        FROM parking_history h
+        JOIN parking_lots l ON h.lot_id = l.id
+        WHERE h.exit_time IS NULL AND h.entry_time < ?
+        ORDER BY h.entry_time
+        LIMIT ?
+    ''', (cutoff, batch)).fetchall()
+    if not sessions:
+        return [], [], 0
+
+    costs = tariff.costs(
+        [tariff.duration_hours(row['entry_time'], now) for row in sessions],
+        [row['base_price'] for row in sessions],
+        [row['base_duration'] for row in sessions],
+        [row['extra_hour_price'] for row in sessions],
+    )
+    closing = json.dumps([
+        {'id': row['id'], 'user_id': row['user_id'], 'spot_id': row['spot_id'], 'cost': cost}
+        for row, cost in zip(sessions, costs)
+    ])
+
+    conn.execute('''
+        UPDATE parking_history
+        SET exit_time = ?, cost = j.value ->> 'cost'
+        FROM json_each(?) j
+        WHERE parking_history.id = j.value ->> 'id'
+    ''', (now.isoformat(), closing))
+
+    # Only spots still held by the session's driver; a spot that already
+    # changed hands stays as it is. available_spots follows by trigger.
+    freed = conn.execute('''
+        UPDATE parking_spots
+        SET is_occupied = 0, current_user_id = NULL
+        FROM json_each(?) j
+        WHERE parking_spots.id = j.value ->> 'spot_id'
+          AND parking_spots.current_user_id = j.value ->> 'user_id'
+        RETURNING parking_spots.lot_id, parking_spots.id
+    ''', (closing,)).fetchall()
+
+    rollups.record_exits(conn, [(row['lot_id'], row['entry_time'], now, cost)
+                                for row, cost in zip(sessions, costs)])
+    # RETURNING can't read json_each; a freed spot was held by its session's driver
+    drivers = {row['spot_id']: row['user_id'] for row in sessions}
+    return sessions, [(lot_id, spot_id, drivers[spot_id]) for lot_id, spot_id in freed], sum(costs)
+
+
+def auto_checkout(conn, allocator=None, older_than_hours=AUTO_CHECKOUT_AFTER_HOURS,
+                  batch=CHECKOUT_BATCH, on_freed=None, now=None):
+    """Close every open session that started more than older_than_hours ago.
+
+    Freed spots go back to `allocator` after each batch commits, and
+    on_freed(lot_id, spot_id, user_id) is called for each of them. Without an
+    allocator (the CLI), a running app finds the spots again through
+    SpotAllocator.verify when a lot looks full. Returns a CheckoutResult.
+    """
+    started = time.perf_counter()
+    now = now or datetime.now()
+    cutoff = (now - timedelta(hours=older_than_hours)).isoformat()
+
+    sessions = spots_freed = 0
+    revenue = 0
+    while True:
+        closed, freed, amount = booking.run_with_retry(
+            conn, lambda conn: _checkout_batch(conn, cutoff, now, batch))
+        if not closed:
+            break
+        sessions += len(closed)
+        spots_freed += len(freed)
+        revenue += amount
+        for lot_id, spot_id, user_id in freed:
+            if allocator is not None:
+                allocator.release(lot_id, spot_id)
+            if on_freed is not None:
+                on_freed(lot_id, spot_id, user_id)
+
+    return CheckoutResult(sessions, spots_freed, tariff.round_cents(revenue),
+                          time.perf_counter() - started)
+
+
+def combine(results):
+    """One CheckoutResult for runs done side by side (one per shard)."""
+    return CheckoutResult(sum(r.sessions for r in results), sum(r.spots_freed for r in results),
+                          tariff.round_cents(sum(r.revenue for r in results)),
+                          max((r.seconds for r in results), default=0))
+
+
+class AutoCheckoutScheduler:
+    """Runs auto_checkout() every `interval` seconds on a background thread."""
+
+    def __init__(self, allocator, older_than_hours=AUTO_CHECKOUT_AFTER_HOURS,
+                 interval=CHECKOUT_INTERVAL, on_freed=None, path=None):
+        self.allocator = allocator
+        self.path = path  # database file to check out in, db.DATABASE by default
+        self.older_than_hours = older_than_hours
+        self.interval = interval
+        self.on_freed = on_freed
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        conn = connect(self.path)
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    result = auto_checkout(conn, self.allocator, self.older_than_hours,
+                                           on_freed=self.on_freed)
+                except sqlite3.Error:
+                    # Whatever is left is still open and past the cutoff next time
+                    log.exception('auto checkout failed')
+                    continue
+                if result.sessions:
+                    log.info('auto checkout: closed %d sessions, freed %d spots in %.2fs',
+                             result.sessions, result.spots_freed, result.seconds)
+        finally:
+            conn.close()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='auto-checkout', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check out parking sessions left open too long.')
+    parser.add_argument('command', choices=['run'])
+    parser.add_argument('--hours', type=float, default=AUTO_CHECKOUT_AFTER_HOURS,
+                        help='close sessions that started more than this many hours ago')
+    parser.add_argument('--batch', type=int, default=CHECKOUT_BATCH, help='sessions per transaction')
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        result = auto_checkout(conn, older_than_hours=args.hours, batch=args.batch)
+    finally:
+        conn.close()
+    print(f"✅ Checked out {result.sessions} sessions ({result.spots_freed} spots freed, "
+          f"₹{result.revenue:.2f} billed) in {result.seconds:.2f}s")
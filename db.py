@@ -0,0 +1,187 @@
+import os
+import queue
+import sqlite3
+import threading
+import urllib.parse
+
+from flask import g
+
+DATABASE = os.environ.get('PARKING_DB', 'parking.db')
+# Old closed sessions (see archive.py); attached as `archive` to the
+# connections that read or move them, see attach_archive()
+ARCHIVE_DATABASE = os.environ.get('PARKING_ARCHIVE_DB')
+POOL_SIZE = int(os.environ.get('PARKING_DB_POOL_SIZE', 16))
+POOL_TIMEOUT = 10  # seconds to wait for a free connection
+
+# Applied to every connection we open. WAL lets readers run alongside the
+# single writer; synchronous=NORMAL is durable enough in WAL mode and skips
+# an fsync per commit.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('cache_size', -16000),  # negative means KiB, so ~16 MB per connection
+    ('temp_store', 'MEMORY'),
+)
+# Snapshots are read-only files, so only the cache settings apply
+SNAPSHOT_PRAGMAS = (
+    ('cache_size', -16000),
+    ('temp_store', 'MEMORY'),
+)
+
+
+class Connection(sqlite3.Connection):
+    database_path = None  # the file connect() opened
+    archive_attached = False
+
+
+# Class of the connections connect() opens; metrics.init_app swaps in one
+# that times every statement
+connection_factory = Connection
+
+# Callables run on every new connection, e.g. to install a trace callback
+# (the benchmarks use this to count queries per request)
+_connect_hooks = []
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+def add_connect_hook(hook):
+    _connect_hooks.append(hook)
+
+
+def archive_path(path):
+    # parking.db -> parking_archive.db unless PARKING_ARCHIVE_DB says otherwise
+    if ARCHIVE_DATABASE and path == DATABASE:
+        return ARCHIVE_DATABASE
+    return os.path.splitext(path)[0] + '_archive.db'
+
+
+def _snapshot_uri(path):
+    # mode=ro: a missing snapshot is an error, not a new empty file
+    return f'file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro&immutable=1'
+
+
+def connect(path=None, snapshot=False, archive=False):
+    """Open a tuned connection outside the pool (scripts, migrations, jobs).
+
+    archive=True attaches the archive up front, for jobs that write to it
+    or read it inside a write transaction. snapshot=True opens a file
+    nothing writes to any more (see replica.py) read-only and without
+    locking, archive included.
+    """
+    path = path or DATABASE
+    if snapshot:
+        conn = sqlite3.connect(_snapshot_uri(path), uri=True, check_same_thread=False,
+                               factory=connection_factory)
+    else:
+        conn = sqlite3.connect(path, timeout=5, check_same_thread=False,
+                               factory=connection_factory)
+    conn.row_factory = sqlite3.Row
+    conn.database_path = path
+    for name, value in (SNAPSHOT_PRAGMAS if snapshot else PRAGMAS):
+        conn.execute(f'PRAGMA {name} = {value}')
+    if snapshot:
+        conn.execute('ATTACH DATABASE ? AS archive', (_snapshot_uri(archive_path(path)),))
+        conn.archive_attached = True
+    elif archive:
+        attach_archive(conn)
+    for hook in _connect_hooks:
+        hook(conn)
+    return conn
+
+
+def attach_archive(conn):
+    """Attach the archive of conn's database as `archive`, unless it is already.
+
+    BEGIN IMMEDIATE takes the write lock on every attached file, so only
+    connections that need the archive carry it; the pool detaches it again
+    when a connection comes back. SQLite refuses inside a transaction.
+    """
+    if not conn.archive_attached:
+        conn.execute('ATTACH DATABASE ? AS archive', (archive_path(conn.database_path),))
+        conn.execute('PRAGMA archive.synchronous = NORMAL')
+        conn.archive_attached = True
+    return conn
+
+
+class ConnectionPool:
+    """A bounded pool of connections to one database file.
+
+    At most `size` connections are handed out at once; idle ones are reused
+    most-recently-returned first so their page caches stay warm.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self, timeout=POOL_TIMEOUT):
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolExhausted(f'no free connection to {self.path} after {timeout}s')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return connect(self.path)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            if conn.archive_attached:
+                # So the next reserve's write transaction doesn't lock it too
+                conn.execute('DETACH DATABASE archive')
+                conn.archive_attached = False
+        except sqlite3.Error:
+            # Broken connection; drop it and let the next acquire open a new one
+            conn.close()
+        else:
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DATABASE)
+    return _pool
+
+
+def get_db():
+    """The connection for the current request, checked out of the pool once."""
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
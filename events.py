@@ -0,0 +1,107 @@
+import itertools
+import json
+import threading
+from collections import deque
+
+# Occupancy events for Server-Sent Events clients. Write paths publish into
+# an in-process broker, which copies each event into every subscriber's
+# queue; each open /events/occupancy response drains its own queue. Nothing
+# here touches the database, so open dashboards cost a thread and a small
+# deque each, not a query per poll.
+#
+# Queues are bounded: a client that can't keep up loses its oldest events
+# and is told to resync instead of making the publisher wait. Events only
+# reach clients connected to the process that handled the write.
+
+QUEUE_SIZE = 256
+MAX_SUBSCRIBERS = 500
+KEEPALIVE_INTERVAL = 15  # seconds between comment lines on an idle stream
+
+# Fields only admins get to see
+ADMIN_FIELDS = ('user_email',)
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, lot_id=None, admin=False, size=QUEUE_SIZE):
+        self.lot_id = lot_id
+        self.admin = admin
+        self.dropped = 0
+        self._queue = deque(maxlen=size)
+        self._cond = threading.Condition()
+
+    def put(self, event):
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1  # the append below pushes the oldest out
+            self._queue.append(event)
+            self._cond.notify()
+
+    def get_all(self, timeout):
+        """Wait up to timeout for events; returns (events, dropped since last call)."""
+        with self._cond:
+            if not self._queue:
+                self._cond.wait(timeout)
+            events = list(self._queue)
+            self._queue.clear()
+            dropped, self.dropped = self.dropped, 0
+        return events, dropped
+
+
+class Broker:
+    def __init__(self, max_subscribers=MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, lot_id=None, admin=False):
+        subscription = Subscription(lot_id, admin)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise TooManySubscribers()
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event_type, lot_id, **data):
+        event = dict(data, id=next(self._ids), type=event_type, lot_id=lot_id)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if subscription.lot_id is None or lot_id is None or subscription.lot_id == lot_id:
+                subscription.put(event)
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers), 'max_subscribers': self.max_subscribers}
+
+    def stream(self, subscription, keepalive=KEEPALIVE_INTERVAL):
+        """Generator of text/event-stream chunks for one subscriber."""
+        try:
+            # Tell EventSource how long to wait before reconnecting
+            yield 'retry: 3000\n\n'
+            while True:
+                events, dropped = subscription.get_all(keepalive)
+                if dropped:
+                    yield f'event: resync\ndata: {json.dumps({"dropped": dropped})}\n\n'
+                if not events:
+                    yield ': keepalive\n\n'
+                    continue
+                yield ''.join(_format(event, subscription.admin) for event in events)
+        finally:
+            # Runs when the client disconnects and the server closes us, if
+            # the body was started; callers also unsubscribe on response close
+            self.unsubscribe(subscription)
+
+
+def _format(event, admin):
+    if not admin:
+        event = {k: v for k, v in event.items() if k not in ADMIN_FIELDS}
+    return f'id: {event["id"]}\nevent: {event["type"]}\ndata: {json.dumps(event)}\n\n'
@@ -0,0 +1,165 @@
+import base64
+import binascii
+import heapq
+from datetime import date, timedelta
+
+import archive
+
+# Keyset pagination over parking_history, newest first. A page is "the next
+# PAGE_SIZE rows before (entry_time, id)", which SQLite answers with an index
+# range scan, so page 10,000 costs the same as page 1. Once the hot page is
+# known, the archive is only queried if its rows could still make the page.
+PAGE_SIZE = 50
+
+STATUSES = ('open', 'closed')
+
+
+def encode_cursor(entry_time, history_id):
+    raw = f'{entry_time}|{history_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Returns (entry_time, id), or None if the token is missing or malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        entry_time, history_id = raw.rsplit('|', 1)
+        return entry_time, int(history_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def parse_filters(args):
+    """Pull the lot/date/status filters out of request.args, dropping bad values."""
+    filters = {}
+
+    lot_id = args.get('lot_id', '').strip()
+    if lot_id.isdigit():
+        filters['lot_id'] = int(lot_id)
+
+    for key in ('date_from', 'date_to'):
+        value = args.get(key, '').strip()
+        try:
+            filters[key] = date.fromisoformat(value)
+        except ValueError:
+            pass
+
+    status = args.get('status', '').strip()
+    if status in STATUSES:
+        filters['status'] = status
+
+    return filters
+
+
+def filter_args(filters):
+    """The filters as query-string values, for building page links."""
+    return {key: value.isoformat() if isinstance(value, date) else value
+            for key, value in filters.items()}
+
+
+def build_where(user_id=None, lot_id=None, date_from=None, date_to=None, status=None):
+    """SQL conditions on parking_history (aliased h) for the given filters."""
+    where = []
+    params = []
+
+    if user_id is not None:
+        where.append('h.user_id = ?')
+        params.append(user_id)
+    if lot_id is not None:
+        where.append('h.lot_id = ?')
+        params.append(lot_id)
+    if date_from is not None:
+        where.append('h.entry_time >= ?')
+        params.append(date_from.isoformat())
+    if date_to is not None:
+        # Inclusive: everything that started before the next day
+        where.append('h.entry_time < ?')
+        params.append((date_to + timedelta(days=1)).isoformat())
+    if status == 'open':
+        where.append('h.exit_time IS NULL')
+    elif status == 'closed':
+        where.append('h.exit_time IS NOT NULL')
+    return where, params
+
+
+def merge(row_lists, reverse=False):
+    """Merge per-table row lists sorted by (entry_time, id) into one list.
+
+    A session caught mid-move by the archive job is in both tables; it's
+    kept once.
+    """
+    merged = []
+    last_id = None
+    for row in heapq.merge(*row_lists, key=lambda r: (r['entry_time'], r['id']), reverse=reverse):
+        if row['id'] != last_id:
+            merged.append(row)
+            last_id = row['id']
+    return merged
+
+
+def _page_rows(conn, table, where, params, limit):
+    return conn.execute(f'''
+        SELECT h.*,
+               l.name AS lot_name,
+               l.address AS lot_address,
+               s.spot_number,
+               u.full_name AS user_name
+        FROM {table} h
+        JOIN parking_spots s ON h.spot_id = s.id
+        JOIN parking_lots l ON h.lot_id = l.id
+        JOIN users u ON h.user_id = u.id
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY h.entry_time DESC, h.id DESC
+        LIMIT ?
+    ''', params + [limit]).fetchall()
+
+
+def page(conn, user_id=None, lot_id=None, date_from=None, date_to=None, status=None,
+         cursor=None, limit=PAGE_SIZE):
+    """One page of history rows joined with lot, spot and user names.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    where, params = build_where(user_id, lot_id, date_from, date_to, status)
+
+    position = decode_cursor(cursor)
+    if position:
+        where.append('(h.entry_time, h.id) < (?, ?)')
+        params.extend(position)
+
+    rows = _page_rows(conn, 'main.parking_history', where, params, limit + 1)
+
+    # Archived sessions all started at or before the horizon; skip the
+    # archive when the hot rows already fill the page with newer sessions
+    newest_archived = archive.horizon(conn) if status != 'open' else None
+    if newest_archived and (date_from is None or date_from.isoformat() <= newest_archived):
+        if len(rows) <= limit or rows[-1]['entry_time'] <= newest_archived:
+            archived = _page_rows(conn, 'archive.parking_history', where, params, limit + 1)
+            rows = merge([rows, archived], reverse=True)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['entry_time'], last['id'])
+    return rows, next_cursor
+
+
+def merge_pages(pages, limit=PAGE_SIZE):
+    """Combine page() results for the same cursor from several shards into one page.
+
+    Each shard's page holds its newest `limit` rows past the cursor, so the
+    newest `limit` of all of them is the combined page. Ids are unique
+    across shards, so the cursor stays valid for every shard.
+    """
+    if len(pages) == 1:
+        return pages[0]
+    rows = merge([page_rows for page_rows, _ in pages], reverse=True)
+    more = len(rows) > limit or any(next_cursor for _, next_cursor in pages)
+    rows = rows[:limit]
+    next_cursor = None
+    if more and rows:
+        next_cursor = encode_cursor(rows[-1]['entry_time'], rows[-1]['id'])
+    return rows, next_cursor
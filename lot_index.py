@@ -0,0 +1,111 @@
+import bisect
+import heapq
+import threading
+import time
+
+from availability import LOT_FIELDS
+
+# Lot discovery by pin code, answered from memory. The index keeps every
+# lot's details in a list sorted by pin code, so a pin prefix is two bisects
+# and a slice, however many lots there are; availability comes from the
+# spot allocator's free lists at query time, so it is current without
+# touching the database.
+#
+# "Nearby" is pin code structure: 560001 and 560034 share the 560 sorting
+# district. A search for 560001 lists that pin first, then 56000x, 5600xx
+# and 560xxx, each tier ranked on its own.
+DISCOVERY_LIMIT = 20  # lots per search
+NEARBY_PREFIX = 3  # shortest pin prefix "nearby" widens to
+REBUILD_AFTER = 60  # seconds; picks up lots changed by other worker processes
+
+
+def read_lots(conn):
+    """Every lot in conn's database, as the index stores them."""
+    return [dict(row) for row in conn.execute(f'SELECT {", ".join(LOT_FIELDS)} FROM parking_lots')]
+
+
+def _pin(lot):
+    return (lot['pin_code'] or '').strip()
+
+
+class LotIndex:
+    """Lots by pin code prefix, ranked by free spots and then price.
+
+    free_count(lot_id) gives a lot's live free spots (SpotAllocator.free_count);
+    where it returns None the lot's available_spots as last read is used.
+    """
+
+    def __init__(self, free_count=None, rebuild_after=REBUILD_AFTER):
+        self.free_count = free_count
+        self.rebuild_after = rebuild_after
+        self._lock = threading.Lock()
+        # (lot_id -> lot dict, sorted (pin_code, lot_id) list), replaced
+        # whole and never changed in place, so searches read it without the lock
+        self._state = ({}, [])
+        self._built_at = None
+
+    def stale(self):
+        """True until the first rebuild() and every rebuild_after seconds after."""
+        return self._built_at is None or time.monotonic() - self._built_at > self.rebuild_after
+
+    def rebuild(self, lots):
+        """Replace the index with `lots` (read_lots() rows, from every shard)."""
+        indexed = {lot['id']: lot for lot in lots}
+        keys = sorted((_pin(lot), lot_id) for lot_id, lot in indexed.items())
+        with self._lock:
+            self._state = (indexed, keys)
+            self._built_at = time.monotonic()
+
+    def update(self, conn, lot_id):
+        """Re-read one lot after it was created or edited; drops it if it is gone."""
+        row = conn.execute(f'SELECT {", ".join(LOT_FIELDS)} FROM parking_lots WHERE id = ?',
+                           (lot_id,)).fetchone()
+        with self._lock:
+            lots, keys = dict(self._state[0]), list(self._state[1])
+            old = lots.pop(lot_id, None)
+            if old is not None:
+                keys.remove((_pin(old), lot_id))
+            if row is not None:
+                lots[lot_id] = dict(row)
+                bisect.insort(keys, (_pin(lots[lot_id]), lot_id))
+            self._state = (lots, keys)
+
+    def _available(self, lot):
+        free = self.free_count(lot['id']) if self.free_count is not None else None
+        return (lot['available_spots'] or 0) if free is None else free
+
+    def _with_prefix(self, keys, prefix):
+        start = bisect.bisect_left(keys, (prefix,))
+        end = bisect.bisect_left(keys, (prefix + '\uffff',))
+        return [lot_id for _, lot_id in keys[start:end]]
+
+    def search(self, pin_prefix='', nearby=True, limit=DISCOVERY_LIMIT):
+        """Up to `limit` lots (all with None) whose pin code starts with pin_prefix, best first.
+
+        Each is a dict of LOT_FIELDS with live available_spots and `nearby`
+        set for lots found by widening the prefix. Lots with free spots come
+        before full ones, then cheaper before dearer, then emptier first.
+        """
+        lots, keys = self._state
+        if limit is None:
+            limit = len(lots)
+        prefix = pin_prefix.strip()
+        shortest = min(len(prefix), NEARBY_PREFIX) if nearby else len(prefix)
+
+        found = []
+        seen = set()
+        for length in range(len(prefix), shortest - 1, -1):
+            tier = []
+            for lot_id in self._with_prefix(keys, prefix[:length]):
+                if lot_id in seen:
+                    continue
+                seen.add(lot_id)
+                lot = dict(lots[lot_id])
+                lot['available_spots'] = self._available(lot)
+                lot['nearby'] = length < len(prefix)
+                tier.append(lot)
+            found.extend(heapq.nsmallest(limit - len(found), tier, key=lambda lot: (
+                lot['available_spots'] <= 0, lot['base_price'] or 0, -lot['available_spots'], lot['id'])))
+            if len(found) >= limit:
+                break
+        return found
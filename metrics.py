@@ -0,0 +1,233 @@
+import bisect
+import hmac
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g, request
+
+import db
+
+# Prometheus-style metrics kept in process memory and rendered in the text
+# exposition format by /admin/metrics. Recording is a lock, a bisect and a
+# couple of additions, cheap enough to leave on for every request and every
+# SQL statement.
+#
+# With several worker processes each one reports its own numbers; the
+# scraper adds them up.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+# Lets a scraper without an admin session read /admin/metrics
+METRICS_TOKEN = os.environ.get('PARKING_METRICS_TOKEN')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> count
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labels:
+            values = [((), 0)]
+        for label_values, value in values:
+            lines.append(f'{self.name}{_label_text(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, counts in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _label_text(self.labels + ('le',), label_values + (bound,))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _label_text(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {counts[-1]}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'parking_request_duration_seconds', 'Wall time spent handling a request.',
+    ('endpoint', 'method'))
+REQUESTS = Counter(
+    'parking_requests_total', 'Requests handled, by response status.',
+    ('endpoint', 'method', 'status'))
+REQUEST_STATEMENTS = Histogram(
+    'parking_request_sql_statements', 'SQL statements executed per request.',
+    ('endpoint',), STATEMENT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram(
+    'parking_request_sql_seconds', 'Time spent executing SQL per request.',
+    ('endpoint',))
+SQL_STATEMENTS = Counter(
+    'parking_sql_statements_total', 'SQL statements executed by any thread.')
+SQL_SECONDS = Counter(
+    'parking_sql_seconds_total', 'Time spent executing SQL statements by any thread.')
+
+RESERVATIONS = Counter(
+    'parking_reservations_total', 'Spots reserved.')
+RELEASES = Counter(
+    'parking_releases_total', 'Spots released, by what released them.', ('reason',))
+RESERVATION_REJECTIONS = Counter(
+    'parking_reservation_rejections_total', 'Reservations refused.', ('reason',))
+
+REGISTRY = [
+    REQUEST_SECONDS, REQUESTS, REQUEST_STATEMENTS, REQUEST_SQL_SECONDS,
+    SQL_STATEMENTS, SQL_SECONDS, RESERVATIONS, RELEASES, RESERVATION_REJECTIONS,
+]
+
+
+# SQL done by the current thread while it handles a request: [statements, seconds]
+_current = threading.local()
+
+
+def _record_sql(started):
+    elapsed = time.perf_counter() - started
+    SQL_STATEMENTS.inc()
+    SQL_SECONDS.inc(amount=elapsed)
+    totals = getattr(_current, 'totals', None)
+    if totals is not None:
+        totals[0] += 1
+        totals[1] += elapsed
+
+
+def attributed(work):
+    """work, wrapped so the SQL it runs on other threads counts towards this thread's request.
+
+    For fan-outs (shards.Router.fan_out): each worker thread counts into a
+    total of its own, added to the request's when its piece of work ends.
+    """
+    parent = getattr(_current, 'totals', None)
+    if parent is None:
+        return work
+    lock = threading.Lock()
+
+    def run(*args):
+        previous = getattr(_current, 'totals', None)
+        own = _current.totals = [0, 0.0]
+        try:
+            return work(*args)
+        finally:
+            _current.totals = previous
+            with lock:
+                parent[0] += own[0]
+                parent[1] += own[1]
+    return run
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times execute calls. Rows fetched later (row by row) aren't included."""
+
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _record_sql(started)
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _record_sql(started)
+
+
+class InstrumentedConnection(db.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute() would bypass cursor(), so route it through one
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    _current.totals = [0, 0.0]
+
+
+def _after_request(response):
+    # Streamed bodies (exports) are still being generated at this point, so
+    # their SQL only shows up in the process-wide totals
+    started = g.pop('metrics_started', None)
+    totals = getattr(_current, 'totals', None)
+    _current.totals = None
+    if started is None:
+        return response
+
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, request.method)
+    REQUESTS.inc(endpoint, request.method, response.status_code)
+    if totals is not None:
+        REQUEST_STATEMENTS.observe(totals[0], endpoint)
+        REQUEST_SQL_SECONDS.observe(totals[1], endpoint)
+    return response
+
+
+def init_app(app):
+    """Time every request and every statement run on db.connect() connections."""
+    db.connection_factory = InstrumentedConnection
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+
+def authorized():
+    """True if the request carries the scrape token (admins are let in by the route)."""
+    if not METRICS_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}')
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,307 @@
+import sqlite3
+
+import archive
+from db import connect
+from models import create_tables
+
+
+# Schema changes on top of models.create_tables(), applied in order. The
+# database's PRAGMA user_version records how many have run, so each one runs
+# exactly once per parking.db. Only ever append to this list.
+
+def _add_column(conn, table, column, ddl):
+    columns = [col[1] for col in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+
+def _0001_pricing_columns(conn):
+    # Older databases got some of these from database.add_missing_columns()
+    # or by hand, so every column is checked before it is added.
+    _add_column(conn, 'parking_lots', 'price_per_hour', 'REAL DEFAULT 20.0')
+    _add_column(conn, 'parking_lots', 'base_price', 'REAL DEFAULT 80')
+    _add_column(conn, 'parking_lots', 'base_duration', 'INTEGER DEFAULT 2')
+    _add_column(conn, 'parking_lots', 'extra_hour_price', 'REAL DEFAULT 50')
+    _add_column(conn, 'parking_history', 'cost', 'REAL')
+
+
+def _create_indexes(conn, statements):
+    # conn.executescript() would commit the migration's transaction halfway
+    for statement in statements:
+        conn.execute(statement)
+
+
+def _0002_hot_path_indexes(conn):
+    _create_indexes(conn, [
+        # reserve/release/logout/user_dashboard: "which spot does this user hold?"
+        'CREATE INDEX IF NOT EXISTS idx_spots_current_user ON parking_spots(current_user_id)',
+        # free spots per lot, view_spots
+        'CREATE INDEX IF NOT EXISTS idx_spots_lot_occupied ON parking_spots(lot_id, is_occupied)',
+        # the user's open session, profile/user_dashboard vehicle lists
+        'CREATE INDEX IF NOT EXISTS idx_history_user_exit ON parking_history(user_id, exit_time)',
+        # user_history, newest first
+        'CREATE INDEX IF NOT EXISTS idx_history_user_entry ON parking_history(user_id, entry_time)',
+        # delete_lot, analytics per lot
+        'CREATE INDEX IF NOT EXISTS idx_history_lot ON parking_history(lot_id)',
+        # admin_reservations, newest first
+        'CREATE INDEX IF NOT EXISTS idx_history_entry_time ON parking_history(entry_time)',
+        # delete_lot joins reservations to spots
+        'CREATE INDEX IF NOT EXISTS idx_reservations_spot ON reservations(spot_id)',
+    ])
+
+
+def _0003_overdue_tracking(conn):
+    # NULL means "use the app-wide MAX_DURATION_MINUTES"
+    _add_column(conn, 'parking_lots', 'max_duration_minutes', 'INTEGER')
+    # Set by the overdue scheduler when a session runs past its lot's limit
+    _add_column(conn, 'parking_history', 'overdue_at', 'TEXT')
+    _create_indexes(conn, [
+        # Only open sessions are indexed, so this stays as small as the lots are full
+        'CREATE INDEX IF NOT EXISTS idx_history_open ON parking_history(entry_time) WHERE exit_time IS NULL',
+        'CREATE INDEX IF NOT EXISTS idx_history_open_overdue ON parking_history(overdue_at) '
+        'WHERE exit_time IS NULL AND overdue_at IS NOT NULL',
+    ])
+
+
+def _0004_lot_daily_stats(conn):
+    # Rollups for /admin/analytics, see rollups.py
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lot_daily_stats (
+            lot_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            closed_sessions INTEGER NOT NULL DEFAULT 0,
+            billed_sessions INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            duration_seconds REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (lot_id, day)
+        ) WITHOUT ROWID
+    ''')
+    # Seed from the existing history; from here on the write paths keep it current
+    conn.execute('''
+        INSERT INTO lot_daily_stats
+            (lot_id, day, sessions, closed_sessions, billed_sessions, revenue, duration_seconds)
+        SELECT lot_id, substr(entry_time, 1, 10),
+               COUNT(*), COUNT(exit_time), COUNT(cost), COALESCE(SUM(cost), 0),
+               COALESCE(SUM((julianday(exit_time) - julianday(entry_time)) * 86400), 0)
+        FROM parking_history
+        GROUP BY lot_id, substr(entry_time, 1, 10)
+    ''')
+
+
+def _0005_history_keyset_indexes(conn):
+    # Paging one lot's history newest-first; also serves every lot_id lookup
+    # idx_history_lot did, so that one goes
+    _create_indexes(conn, [
+        'CREATE INDEX IF NOT EXISTS idx_history_lot_entry ON parking_history(lot_id, entry_time)',
+    ])
+    conn.execute('DROP INDEX IF EXISTS idx_history_lot')
+
+
+def _0006_vehicle_search(conn):
+    # Distinct (user, vehicle) pairs, kept current by a trigger on history,
+    # so vehicle lookups don't have to GROUP BY all of parking_history
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_vehicles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            vehicle_number TEXT NOT NULL,
+            UNIQUE (user_id, vehicle_number),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_history_user_vehicle
+        AFTER INSERT ON parking_history
+        BEGIN
+            INSERT OR IGNORE INTO user_vehicles (user_id, vehicle_number)
+            VALUES (NEW.user_id, NEW.vehicle_number);
+        END
+    ''')
+
+    # Trigram full-text index over name, email and plate, one row per
+    # user_vehicles row (same rowid). Builds without FTS5 skip it and
+    # vehicle_search.py falls back to LIKE over user_vehicles.
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS vehicle_search_fts
+            USING fts5(full_name, email, vehicle_number, tokenize = 'trigram')
+        ''')
+    except sqlite3.OperationalError:
+        has_fts = False
+    else:
+        has_fts = True
+
+    if has_fts:
+        for statement in ('''
+            CREATE TRIGGER IF NOT EXISTS trg_user_vehicles_fts_insert
+            AFTER INSERT ON user_vehicles
+            BEGIN
+                INSERT INTO vehicle_search_fts (rowid, full_name, email, vehicle_number)
+                SELECT NEW.id, u.full_name, u.email, NEW.vehicle_number
+                FROM users u WHERE u.id = NEW.user_id;
+            END
+        ''', '''
+            CREATE TRIGGER IF NOT EXISTS trg_user_vehicles_fts_delete
+            AFTER DELETE ON user_vehicles
+            BEGIN
+                DELETE FROM vehicle_search_fts WHERE rowid = OLD.id;
+            END
+        ''', '''
+            CREATE TRIGGER IF NOT EXISTS trg_users_fts_update
+            AFTER UPDATE OF full_name, email ON users
+            BEGIN
+                UPDATE vehicle_search_fts
+                SET full_name = NEW.full_name, email = NEW.email
+                WHERE rowid IN (SELECT id FROM user_vehicles WHERE user_id = NEW.id);
+            END
+        '''):
+            conn.execute(statement)
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_vehicles_delete
+        AFTER DELETE ON users
+        BEGIN
+            DELETE FROM user_vehicles WHERE user_id = OLD.id;
+        END
+    ''')
+
+    # Backfill; the insert trigger above fills the FTS index as it goes
+    conn.execute('''
+        INSERT OR IGNORE INTO user_vehicles (user_id, vehicle_number)
+        SELECT DISTINCT user_id, vehicle_number FROM parking_history
+    ''')
+
+
+def _0007_available_spots_triggers(conn):
+    # parking_lots.available_spots now follows parking_spots inside the very
+    # statement that changes a spot, so no write path patches it by hand
+    for statement in ('''
+        CREATE TRIGGER IF NOT EXISTS trg_spots_occupied_update
+        AFTER UPDATE OF is_occupied ON parking_spots
+        WHEN (OLD.is_occupied IS 1) IS NOT (NEW.is_occupied IS 1)
+        BEGIN
+            UPDATE parking_lots
+            SET available_spots = available_spots + CASE WHEN NEW.is_occupied IS 1 THEN -1 ELSE 1 END
+            WHERE id = NEW.lot_id;
+        END
+    ''', '''
+        CREATE TRIGGER IF NOT EXISTS trg_spots_insert
+        AFTER INSERT ON parking_spots
+        WHEN NEW.is_occupied IS NOT 1
+        BEGIN
+            UPDATE parking_lots SET available_spots = available_spots + 1 WHERE id = NEW.lot_id;
+        END
+    ''', '''
+        CREATE TRIGGER IF NOT EXISTS trg_spots_delete
+        AFTER DELETE ON parking_spots
+        WHEN OLD.is_occupied IS NOT 1
+        BEGIN
+            UPDATE parking_lots SET available_spots = available_spots - 1 WHERE id = OLD.lot_id;
+        END
+    '''):
+        conn.execute(statement)
+
+    # Start from the true counts, fixing whatever had drifted before
+    conn.execute('''
+        UPDATE parking_lots
+        SET available_spots = (
+            SELECT COUNT(*) FROM parking_spots s
+            WHERE s.lot_id = parking_lots.id AND s.is_occupied IS NOT 1
+        )
+    ''')
+
+
+def _0008_lot_directory(conn):
+    # Which shard file holds each lot (see shards.py); only the catalog's
+    # copy is used, and only when PARKING_SHARDS is above 1. Rows outlive
+    # their lots so an id is never handed out twice.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lot_directory (
+            id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL
+        )
+    ''')
+
+
+def _0009_active_users(conn):
+    # The shard each user holds a spot in (see shards.Router.claim). Like
+    # lot_directory only the catalog's copy is used; the primary key is what
+    # stops one user taking spots in two shards at once.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS active_users (
+            user_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL,
+            claimed_at TEXT NOT NULL
+        )
+    ''')
+
+
+MIGRATIONS = [
+    _0001_pricing_columns,
+    _0002_hot_path_indexes,
+    _0003_overdue_tracking,
+    _0004_lot_daily_stats,
+    _0005_history_keyset_indexes,
+    _0006_vehicle_search,
+    _0007_available_spots_triggers,
+    _0008_lot_directory,
+    _0009_active_users,
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn=None, path=None):
+    """Create the base tables and apply any pending migrations.
+
+    path picks another database file than db.DATABASE (e.g. a shard), in
+    which case conn, if given, must be connected to it.
+    Returns the list of migration names that were applied.
+    """
+    create_tables(path)
+
+    own_conn = conn is None
+    if own_conn:
+        conn = connect(path)
+
+    applied = []
+    try:
+        while schema_version(conn) < len(MIGRATIONS):
+            # Take the write lock first so two processes starting together
+            # don't both apply the same step
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = schema_version(conn)
+                if version >= len(MIGRATIONS):
+                    conn.rollback()
+                    break
+                migration = MIGRATIONS[version]
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {version + 1}')
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            applied.append(migration.__name__.lstrip('_'))
+
+        if applied:
+            conn.execute('PRAGMA optimize')
+
+        # The archive file has no migrations of its own, just this
+        archive.ensure_schema(conn)
+    finally:
+        if own_conn:
+            conn.close()
+
+    return applied
+
+
+if __name__ == '__main__':
+    applied = migrate()
+    for name in applied:
+        print(f"✅ Applied migration {name}")
+    if not applied:
+        print("ℹ️ Schema already up to date.")
@@ -1,7 +1,7 @@
-import sqlite3
+from db import connect
 
-def create_tables():
-    conn = sqlite3.connect('parking.db')
+def create_tables(path=None):
+    conn = connect(path)
     c = conn.cursor()
 
     # Users Table
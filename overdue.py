@@ -0,0 +1,165 @@
+import heapq
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from booking import run_with_retry
+from db import connect
+
+log = logging.getLogger(__name__)
+
+# How often the scheduler re-runs the SQL sweep even if nothing is due. The
+# heap only knows about sessions this process started; the sweep also
+# catches sessions started by other workers.
+SWEEP_INTERVAL = 60  # seconds
+
+
+def sweep(conn, default_minutes, now=None):
+    """Mark every open session that has run past its lot's limit. Returns the count.
+
+    Only open sessions are looked at (idx_history_open), so the cost follows
+    how many cars are parked right now, not how much history there is.
+    """
+    now = (now or datetime.now()).isoformat()
+    return run_with_retry(conn, lambda conn: conn.execute('''
+        UPDATE parking_history
+        SET overdue_at = ?
+        WHERE exit_time IS NULL AND overdue_at IS NULL
+          AND julianday(entry_time) + COALESCE(
+                (SELECT max_duration_minutes FROM parking_lots l WHERE l.id = parking_history.lot_id),
+                ?
+              ) / 1440.0 <= julianday(?)
+    ''', (now, default_minutes, now)).rowcount)
+
+
+def alerts(conn):
+    """Open sessions already marked overdue, longest-parked first."""
+    return conn.execute('''
+        SELECT r.vehicle_number, r.entry_time, u.full_name, l.name AS lot_name
+        FROM parking_history r
+        JOIN users u ON r.user_id = u.id
+        JOIN parking_lots l ON r.lot_id = l.id
+        WHERE r.exit_time IS NULL AND r.overdue_at IS NOT NULL
+        ORDER BY r.entry_time
+    ''').fetchall()
+
+
+class OverdueScheduler:
+    """Marks sessions overdue the moment they pass their lot's time limit.
+
+    Open sessions sit in a min-heap keyed by expiry time. A background thread
+    sleeps until the earliest one is due, marks everything that has expired
+    and goes back to sleep. Released sessions are not removed from the heap;
+    marking them is a no-op because they are no longer open.
+    """
+
+    def __init__(self, default_minutes, path=None):
+        self.default_minutes = default_minutes
+        self.path = path  # database file to watch, db.DATABASE by default
+        self._heap = []  # (expires_at, history_id)
+        self._limits = {}  # lot_id -> max_duration_minutes, None for default
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def _limit(self, lot_id):
+        minutes = self._limits.get(lot_id)
+        return self.default_minutes if minutes is None else minutes
+
+    def reload(self, conn):
+        """Rebuild the heap from the open sessions, e.g. after a lot's limit changed."""
+        limits = {row['id']: row['max_duration_minutes'] for row in conn.execute(
+            'SELECT id, max_duration_minutes FROM parking_lots'
+        )}
+        open_sessions = conn.execute('''
+            SELECT id, lot_id, entry_time FROM parking_history
+            WHERE exit_time IS NULL AND overdue_at IS NULL
+        ''').fetchall()
+
+        with self._cond:
+            self._limits = limits
+            self._heap = [
+                (datetime.fromisoformat(row['entry_time']) + timedelta(minutes=self._limit(row['lot_id'])),
+                 row['id'])
+                for row in open_sessions
+            ]
+            heapq.heapify(self._heap)
+            self._cond.notify()
+
+    def reset_lot(self, conn, lot_id):
+        """Re-evaluate a lot's open sessions after its time limit was edited."""
+        run_with_retry(conn, lambda conn: conn.execute('''
+            UPDATE parking_history
+            SET overdue_at = NULL
+            WHERE lot_id = ? AND exit_time IS NULL AND overdue_at IS NOT NULL
+        ''', (lot_id,)))
+        self.reload(conn)
+
+    def schedule(self, history_id, lot_id, entry_time):
+        if isinstance(entry_time, str):
+            entry_time = datetime.fromisoformat(entry_time)
+        with self._cond:
+            expires_at = entry_time + timedelta(minutes=self._limit(lot_id))
+            heapq.heappush(self._heap, (expires_at, history_id))
+            if self._heap[0][1] == history_id:
+                # New earliest deadline; wake the thread so it sleeps less
+                self._cond.notify()
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+        return due
+
+    def _mark(self, conn, due, now):
+        run_with_retry(conn, lambda conn: conn.executemany('''
+            UPDATE parking_history
+            SET overdue_at = ?
+            WHERE id = ? AND exit_time IS NULL AND overdue_at IS NULL
+        ''', [(now.isoformat(), history_id) for _, history_id in due]))
+
+    def _run(self):
+        conn = connect(self.path)
+        try:
+            self.reload(conn)
+            sweep(conn, self.default_minutes)
+            next_sweep = datetime.now() + timedelta(seconds=SWEEP_INTERVAL)
+
+            while True:
+                with self._cond:
+                    while not self._stopping:
+                        now = datetime.now()
+                        due = self._pop_due(now)
+                        if due or now >= next_sweep:
+                            break
+                        wake_at = min(next_sweep, self._heap[0][0]) if self._heap else next_sweep
+                        self._cond.wait((wake_at - now).total_seconds())
+                    if self._stopping:
+                        return
+
+                try:
+                    if due:
+                        self._mark(conn, due, now)
+                    if now >= next_sweep:
+                        sweep(conn, self.default_minutes, now)
+                except sqlite3.Error:
+                    # Anything we failed to mark is picked up by the next sweep
+                    log.exception('overdue scheduler: marking sessions failed')
+                if now >= next_sweep:
+                    next_sweep = now + timedelta(seconds=SWEEP_INTERVAL)
+        finally:
+            conn.close()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='overdue-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
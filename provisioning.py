@@ -0,0 +1,139 @@
+import csv
+
+# Spots are generated inside SQLite with a recursive CTE, one statement per
+# chunk, instead of one INSERT round trip per spot.
+SPOT_CHUNK = 50000
+
+# The CSV import commits after this many spots so the write lock is released
+# regularly and a failed row only loses the current chunk.
+IMPORT_COMMIT_SPOTS = 50000
+
+# Only the first few bad rows are kept for the report
+MAX_REPORTED_ERRORS = 20
+
+TARIFF_COLUMNS = ('base_price', 'base_duration', 'extra_hour_price')
+
+
+class LotImportError(Exception):
+    pass
+
+
+def provision_spots(conn, lot_id, count, start=1):
+    """Insert spots Spot-<start> .. Spot-<start + count - 1> for lot_id."""
+    last = start + count - 1
+    first = start
+    while first <= last:
+        chunk_last = min(last, first + SPOT_CHUNK - 1)
+        conn.execute('''
+            WITH RECURSIVE seq(n) AS (
+                SELECT ?
+                UNION ALL
+                SELECT n + 1 FROM seq WHERE n < ?
+            )
+            INSERT INTO parking_spots (lot_id, spot_number, is_occupied)
+            SELECT ?, 'Spot-' || n, 0 FROM seq
+        ''', (first, chunk_last, lot_id))
+        first = chunk_last + 1
+
+
+def create_lot(conn, name, address, pin_code, total_spots, lot_id=None, **tariff):
+    """Insert a lot and all of its spots. The caller commits.
+
+    available_spots starts at 0 and is counted up by the spot insert trigger.
+    lot_id is only passed when the id was handed out elsewhere (shards.py).
+    tariff may carry base_price, base_duration and extra_hour_price; any that
+    are left out get the column defaults.
+    """
+    columns = ['name', 'address', 'pin_code', 'total_spots', 'available_spots']
+    values = [name, address, pin_code, total_spots, 0]
+    if lot_id is not None:
+        columns.append('id')
+        values.append(lot_id)
+    for column in TARIFF_COLUMNS:
+        if tariff.get(column) is not None:
+            columns.append(column)
+            values.append(tariff[column])
+
+    placeholders = ', '.join('?' for _ in columns)
+    cursor = conn.execute(
+        f'INSERT INTO parking_lots ({", ".join(columns)}) VALUES ({placeholders})',
+        values
+    )
+    lot_id = cursor.lastrowid
+    provision_spots(conn, lot_id, total_spots)
+    return lot_id
+
+
+def _parse_row(row):
+    for column in ('name', 'address', 'total_spots'):
+        if not (row.get(column) or '').strip():
+            raise LotImportError(f"missing '{column}'")
+
+    try:
+        total_spots = int(row['total_spots'])
+    except ValueError:
+        raise LotImportError(f"total_spots '{row['total_spots']}' is not a number")
+    if total_spots < 1:
+        raise LotImportError('total_spots must be at least 1')
+
+    tariff = {}
+    for column, convert in (('base_price', float), ('base_duration', int), ('extra_hour_price', float)):
+        value = (row.get(column) or '').strip()
+        if value:
+            try:
+                tariff[column] = convert(value)
+            except ValueError:
+                raise LotImportError(f"{column} '{value}' is not a number")
+
+    return (row['name'].strip(), row['address'].strip(), (row.get('pin_code') or '').strip(),
+            total_spots, tariff)
+
+
+def import_lots_csv(conn, lines, new_lot=None):
+    """Create lots from CSV text, one lot per row.
+
+    Columns: name, address, pin_code, total_spots and optionally base_price,
+    base_duration, extra_hour_price. Rows are read one at a time, so memory
+    stays flat however long the file is. Bad rows are skipped. new_lot()
+    returns (connection, lot_id) for each lot (see shards.Router.new_lot);
+    by default every lot goes into conn.
+
+    Returns (lots_created, spots_created, skipped, errors) where errors holds
+    (line_number, message) for the first MAX_REPORTED_ERRORS skipped rows.
+    """
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames or 'total_spots' not in reader.fieldnames:
+        raise LotImportError('CSV needs a header row with name, address, pin_code, total_spots')
+
+    new_lot = new_lot or (lambda: (conn, None))
+    touched = {conn}
+    errors = []
+    skipped = 0
+    lots_created = 0
+    spots_created = 0
+    pending_spots = 0
+
+    for row in reader:
+        try:
+            name, address, pin_code, total_spots, tariff = _parse_row(row)
+        except LotImportError as e:
+            skipped += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append((reader.line_num, str(e)))
+            continue
+
+        lot_conn, lot_id = new_lot()
+        touched.add(lot_conn)
+        create_lot(lot_conn, name, address, pin_code, total_spots, lot_id, **tariff)
+        lots_created += 1
+        spots_created += total_spots
+        pending_spots += total_spots
+
+        if pending_spots >= IMPORT_COMMIT_SPOTS:
+            for each in touched:
+                each.commit()
+            pending_spots = 0
+
+    for each in touched:
+        each.commit()
+    return lots_created, spots_created, skipped, errors
@@ -0,0 +1,172 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from db import DATABASE, archive_path, connect
+
+log = logging.getLogger(__name__)
+
+# Read-only snapshots for the report pages (/admin/analytics,
+# /admin/reservations, /admin/vehicles), so their long scans run against a
+# copy instead of the parking.db that reserve and release write to.
+#
+# Every REPLICA_INTERVAL seconds a background thread copies the live
+# database and its archive with the sqlite3 backup API into a new pair of
+# files (parking_replica<pid>_<n>.db and its _archive.db) and switches
+# readers over. Each app process keeps its own. The cold archive only grows
+# when the archive job runs, so while it hasn't changed the new pair links
+# to the previous copy instead of copying it again.
+#
+# A published snapshot is never written again, so readers open it with
+# immutable=1: no locks, no WAL lookups, nothing a writer could wait on.
+# The pair before the current one is kept until the next refresh, so a
+# request that picked it up just before a switch can still open it.
+REPLICA_INTERVAL = 120  # seconds between snapshots
+
+
+class Snapshot:
+    """One published copy: its file and when the copy was read."""
+
+    def __init__(self, path, taken_at):
+        self.path = path
+        self.taken_at = taken_at
+
+    def age(self):
+        return (datetime.now() - self.taken_at).total_seconds()
+
+
+def _backup(source, target, name='main'):
+    dest = sqlite3.connect(target)
+    try:
+        source.backup(dest, name=name)
+        # The copy carries the source's WAL flag; a plain file is all a snapshot needs
+        dest.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        dest.close()
+
+
+def _archive_version(source):
+    # Changes whenever the archive job adds sessions; it never updates or
+    # deletes archived ones
+    schema = source.execute('PRAGMA archive.schema_version').fetchone()[0]
+    try:
+        rows = tuple(source.execute('SELECT COUNT(*), MAX(entry_time) FROM archive.parking_history').fetchone())
+    except sqlite3.OperationalError:  # archive.ensure_schema hasn't run
+        rows = None
+    return schema, rows
+
+
+def _link(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        return False
+    return True
+
+
+def _remove(path):
+    for file in (path, archive_path(path)):
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # Still open somewhere (Windows)
+            log.warning('could not remove old snapshot %s', file)
+
+
+class Replica:
+    """Keeps a fresh snapshot of one database file on a background thread."""
+
+    def __init__(self, path=None, interval=REPLICA_INTERVAL):
+        self.path = path  # database file to copy, db.DATABASE by default
+        self.interval = interval
+        self._current = None
+        self._previous = None  # kept for readers that picked it up, see refresh()
+        self._archive_version = None  # of the current snapshot's archive copy
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _target(self, generation):
+        base = os.path.splitext(self.path or DATABASE)[0]
+        return f'{base}_replica{os.getpid()}_{generation}.db'
+
+    def current(self):
+        """The latest Snapshot, or None until the first one is ready."""
+        with self._lock:
+            return self._current
+
+    def refresh(self):
+        """Take a snapshot now and publish it. Returns the new Snapshot."""
+        self._generation += 1
+        target = self._target(self._generation)
+        _remove(target)
+
+        source = connect(self.path, archive=True)
+        try:
+            # One read transaction across both files, so a session the
+            # archive job moves mid-copy is in exactly one of them. In WAL
+            # mode this holds no lock a writer waits for, so the copy is done
+            # in one step instead of page batches that restart on every write.
+            source.execute('BEGIN')
+            taken_at = datetime.now()
+            source.execute('SELECT COUNT(*) FROM main.sqlite_master').fetchone()
+            source.execute('SELECT COUNT(*) FROM archive.sqlite_master').fetchone()
+            _backup(source, target)
+            archive_version = _archive_version(source)
+            current = self.current()
+            if current is None or archive_version != self._archive_version \
+                    or not _link(archive_path(current.path), archive_path(target)):
+                _backup(source, archive_path(target), name='archive')
+            source.rollback()
+        except BaseException:
+            source.close()
+            _remove(target)
+            raise
+        source.close()
+
+        snapshot = Snapshot(target, taken_at)
+        with self._lock:
+            previous, self._current = self._current, snapshot
+        self._archive_version = archive_version
+        # The pair before that has had a whole interval to be opened; requests
+        # still reading it keep the files open until they finish
+        if self._previous is not None:
+            _remove(self._previous.path)
+        self._previous = previous
+        return snapshot
+
+    def _run(self):
+        while True:
+            started = time.perf_counter()
+            try:
+                self.refresh()
+            except sqlite3.Error:
+                # Reports keep reading the previous snapshot meanwhile
+                log.exception('snapshot of %s failed', self.path)
+            else:
+                log.info('snapshot of %s taken in %.2fs', self.path, time.perf_counter() - started)
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='replica', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            snapshot, self._current = self._current, None
+        for retired in (snapshot, self._previous):
+            if retired is not None:
+                _remove(retired.path)
+        self._previous = self._archive_version = None
@@ -0,0 +1,165 @@
+import sys
+from datetime import datetime
+
+import archive
+from db import connect
+
+# lot_daily_stats holds one row per lot per entry day, so /admin/analytics
+# aggregates (lots x days) small rows instead of all of parking_history.
+# Sessions are attributed to the day they started, matching how the report
+# has always grouped revenue by entry_time.
+#
+#   sessions         sessions started (open or closed)
+#   closed_sessions  sessions with an exit_time
+#   billed_sessions  closed sessions that have a cost
+#   revenue          sum of cost
+#   duration_seconds sum of exit_time - entry_time over closed sessions
+
+
+def _day(timestamp):
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.isoformat()
+    return timestamp[:10]
+
+
+def record_entry(conn, lot_id, entry_time):
+    """Count a new session. Call inside the transaction that creates it."""
+    conn.execute('''
+        INSERT INTO lot_daily_stats (lot_id, day, sessions)
+        VALUES (?, ?, 1)
+        ON CONFLICT (lot_id, day) DO UPDATE SET sessions = sessions + 1
+    ''', (lot_id, _day(entry_time)))
+
+
+def record_exit(conn, lot_id, entry_time, exit_time, cost):
+    """Add a closed session's duration and cost. Call inside the transaction that closes it."""
+    if isinstance(entry_time, str):
+        entry_time = datetime.fromisoformat(entry_time)
+    if isinstance(exit_time, str):
+        exit_time = datetime.fromisoformat(exit_time)
+    duration = (exit_time - entry_time).total_seconds()
+
+    conn.execute('''
+        INSERT INTO lot_daily_stats (lot_id, day, closed_sessions, billed_sessions, revenue, duration_seconds)
+        VALUES (?, ?, 1, ?, ?, ?)
+        ON CONFLICT (lot_id, day) DO UPDATE SET
+            closed_sessions = closed_sessions + 1,
+            billed_sessions = billed_sessions + excluded.billed_sessions,
+            revenue = revenue + excluded.revenue,
+            duration_seconds = duration_seconds + excluded.duration_seconds
+    ''', (lot_id, _day(entry_time), 0 if cost is None else 1, cost or 0, duration))
+
+
+def record_exits(conn, sessions):
+    """record_exit() for many sessions at once: (lot_id, entry_time, exit_time, cost) tuples.
+
+    Sums per lot and day first, so a batch of thousands of sessions costs one
+    upsert per lot-day.
+    """
+    totals = {}
+    for lot_id, entry_time, exit_time, cost in sessions:
+        if isinstance(entry_time, str):
+            entry_time = datetime.fromisoformat(entry_time)
+        if isinstance(exit_time, str):
+            exit_time = datetime.fromisoformat(exit_time)
+        row = totals.setdefault((lot_id, _day(entry_time)), [0, 0, 0, 0])
+        row[0] += 1
+        row[1] += 0 if cost is None else 1
+        row[2] += cost or 0
+        row[3] += (exit_time - entry_time).total_seconds()
+
+    conn.executemany('''
+        INSERT INTO lot_daily_stats (lot_id, day, closed_sessions, billed_sessions, revenue, duration_seconds)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (lot_id, day) DO UPDATE SET
+            closed_sessions = closed_sessions + excluded.closed_sessions,
+            billed_sessions = billed_sessions + excluded.billed_sessions,
+            revenue = revenue + excluded.revenue,
+            duration_seconds = duration_seconds + excluded.duration_seconds
+    ''', [(lot_id, day, *row) for (lot_id, day), row in totals.items()])
+
+
+def rebuild(conn):
+    """Recompute every rollup row from parking_history and its archive. The caller commits.
+
+    Runs inside the caller's transaction, so conn must have the archive
+    attached already (db.connect(archive=True)).
+    """
+    source = 'main.parking_history'
+    if archive.horizon(conn) is not None:
+        # Skip archived copies of sessions the archive job hasn't deleted yet
+        source = '''(
+            SELECT lot_id, entry_time, exit_time, cost FROM main.parking_history
+            UNION ALL
+            SELECT lot_id, entry_time, exit_time, cost FROM archive.parking_history
+            WHERE id NOT IN (SELECT id FROM main.parking_history)
+        )'''
+
+    conn.execute('DELETE FROM lot_daily_stats')
+    conn.execute(f'''
+        INSERT INTO lot_daily_stats
+            (lot_id, day, sessions, closed_sessions, billed_sessions, revenue, duration_seconds)
+        SELECT lot_id, substr(entry_time, 1, 10),
+               COUNT(*), COUNT(exit_time), COUNT(cost), COALESCE(SUM(cost), 0),
+               COALESCE(SUM((julianday(exit_time) - julianday(entry_time)) * 86400), 0)
+        FROM {source}
+        GROUP BY lot_id, substr(entry_time, 1, 10)
+    ''')
+
+
+def backfill():
+    conn = connect(archive=True)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        rebuild(conn)
+        conn.commit()
+        return conn.execute('SELECT COUNT(*) FROM lot_daily_stats').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def most_used_lots(conn):
+    return conn.execute('''
+        SELECT l.name, SUM(s.sessions) AS total
+        FROM lot_daily_stats s
+        JOIN parking_lots l ON s.lot_id = l.id
+        GROUP BY l.id
+        ORDER BY total DESC
+    ''').fetchall()
+
+
+def monthly_revenue(conn):
+    return conn.execute('''
+        SELECT substr(day, 1, 7) AS month, SUM(revenue) AS revenue
+        FROM lot_daily_stats
+        GROUP BY month
+        HAVING SUM(billed_sessions) > 0
+        ORDER BY month
+    ''').fetchall()
+
+
+def average_duration(conn):
+    return conn.execute('''
+        SELECT l.name, SUM(s.duration_seconds) / SUM(s.closed_sessions) / 3600.0 AS avg_hours
+        FROM lot_daily_stats s
+        JOIN parking_lots l ON s.lot_id = l.id
+        GROUP BY l.id
+        HAVING SUM(s.closed_sessions) > 0
+    ''').fetchall()
+
+
+def merge_monthly_revenue(results):
+    """One monthly_revenue() list out of several (one per shard)."""
+    months = {}
+    for rows in results:
+        for row in rows:
+            months[row['month']] = months.get(row['month'], 0) + row['revenue']
+    return [{'month': month, 'revenue': revenue} for month, revenue in sorted(months.items())]
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['backfill']:
+        print("usage: python rollups.py backfill")
+        sys.exit(2)
+    rows = backfill()
+    print(f"✅ Rebuilt analytics rollups ({rows} lot-day rows)")
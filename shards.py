@@ -0,0 +1,441 @@
+import argparse
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import g, has_app_context
+
+import db
+import metrics
+from booking import AlreadyReserved, run_with_retry
+from migrations import migrate
+
+# Lot-sharded storage, off unless PARKING_SHARDS is above 1.
+#
+# Every write to parking.db queues behind SQLite's single writer lock, so a
+# busy lot slows down reservations everywhere. With N shards, each lot lives
+# in one of N database files (parking_shard0.db ...) together with its spots,
+# sessions, reservations and rollups, and writes to lots in different shards
+# no longer wait for each other. parking.db stays the catalog: the users
+# (with their passwords) and lot_directory, which records the shard of every
+# lot id it hands out.
+#
+# A shard is an ordinary parking database with the full schema, so booking,
+# history_pages, rollups, overdue and friends work on a shard connection as
+# they are. Two things make that hold:
+#   - users are copied into every shard (without passwords) as a read-only
+#     reference table, so joins on users keep working
+#   - shard n numbers its spots, sessions and reservations from n * ID_SPAN,
+#     so ids stay unique across shards and rows can be merged by id
+#
+# Views over all lots fan out to the shards in parallel and merge.
+# A user may hold one spot across all shards; the catalog's active_users
+# table records which shard it is in (see Router.claim).
+# Command-line jobs (archive.py, tariff.py, checkout.py, spot_counts.py) work
+# on one file; run them once per shard with PARKING_DB=parking_shardN.db.
+SHARD_COUNT = int(os.environ.get('PARKING_SHARDS', 1))
+FAN_OUT_WORKERS = 8
+CLAIM_STALE_AFTER = 60  # seconds before a claim without a spot may be taken over
+ID_SPAN = 1 << 40
+
+SHARDED_TABLES = ('parking_spots', 'parking_history', 'reservations')
+USER_COLUMNS = ('id', 'email', 'full_name', 'address', 'pin_code', 'role')
+
+
+def shard_paths(count=SHARD_COUNT, database=None):
+    """Database file of every shard; just the catalog when sharding is off."""
+    database = database or db.DATABASE
+    if count <= 1:
+        return [database]
+    base = os.path.splitext(database)[0]
+    return [f'{base}_shard{n}.db' for n in range(count)]
+
+
+def _seed_ids(conn, index):
+    # Only ever raises a sequence, so it's safe to run on every start
+    for table in SHARDED_TABLES:
+        conn.execute('''
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT ?, 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+        ''', (table, table))
+        conn.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?',
+                     (index * ID_SPAN, table))
+
+
+def replicate_users(conn, users):
+    """Upsert catalog users rows into a shard. The caller commits."""
+    columns = ', '.join(USER_COLUMNS)
+    updates = ', '.join(f'{column} = excluded.{column}' for column in USER_COLUMNS[1:])
+    conn.executemany(f'''
+        INSERT INTO users ({columns}, password)
+        VALUES ({', '.join('?' for _ in USER_COLUMNS)}, '')
+        ON CONFLICT (id) DO UPDATE SET {updates}
+        WHERE ({', '.join('users.' + c for c in USER_COLUMNS[1:])})
+           IS NOT ({', '.join('excluded.' + c for c in USER_COLUMNS[1:])})
+    ''', [tuple(user[column] for column in USER_COLUMNS) for user in users])
+
+
+class Router:
+    """Which database file each lot lives in, and connections to them.
+
+    With a single shard every method hands back the request's usual pooled
+    connection (db.get_db()) and fan-outs run inline, so the unsharded app
+    behaves exactly as before.
+    """
+
+    def __init__(self, paths=None):
+        self.paths = paths or shard_paths()
+        self.sharded = len(self.paths) > 1
+        self._pools = [db.ConnectionPool(path) for path in self.paths] if self.sharded else []
+        self._placement = {}  # lot_id -> shard index
+        self.replicas = []  # one replica.Replica per path, see use_replicas()
+        self._lock = threading.Lock()
+        self._executor = None
+        if self.sharded:
+            self._executor = ThreadPoolExecutor(max_workers=min(FAN_OUT_WORKERS, len(self.paths)),
+                                                thread_name_prefix='shard-fan-out')
+
+    def setup(self):
+        """Bring every shard up to the current schema and copy the users over."""
+        if not self.sharded:
+            return
+        catalog = db.connect()
+        try:
+            users = catalog.execute(f'SELECT {", ".join(USER_COLUMNS)} FROM users').fetchall()
+            for index, path in enumerate(self.paths):
+                migrate(path=path)
+                conn = db.connect(path)
+                try:
+                    def work(conn):
+                        _seed_ids(conn, index)
+                        replicate_users(conn, users)
+                    run_with_retry(conn, work)
+                finally:
+                    conn.close()
+            self._load_placement(catalog)
+            self._claim_held_spots(catalog)
+        finally:
+            catalog.close()
+
+    def _claim_held_spots(self, catalog):
+        # Spots taken before active_users existed; existing claims are kept
+        now = datetime.now().isoformat()
+        held = []
+        for index, path in enumerate(self.paths):
+            conn = db.connect(path)
+            try:
+                held.extend((row[0], index, now) for row in conn.execute(
+                    'SELECT DISTINCT current_user_id FROM parking_spots WHERE current_user_id IS NOT NULL'))
+            finally:
+                conn.close()
+        run_with_retry(catalog, lambda conn: conn.executemany(
+            'INSERT OR IGNORE INTO active_users (user_id, shard, claimed_at) VALUES (?, ?, ?)', held))
+
+    def init_app(self, app):
+        app.teardown_appcontext(self._close)
+
+    def use_replicas(self, replicas):
+        """Serve snapshot=True reads from these (one per path) once they have a snapshot."""
+        self.replicas = replicas
+
+    def _snapshot(self, index):
+        return self.replicas[index].current() if self.replicas else None
+
+    def snapshot_taken_at(self):
+        """When the snapshots reports read were taken (the oldest), None while any is missing."""
+        snapshots = [self._snapshot(index) for index in range(len(self.paths))]
+        if None in snapshots:
+            return None
+        return min(snapshot.taken_at for snapshot in snapshots)
+
+    def _load_placement(self, catalog):
+        placement = dict(catalog.execute('SELECT id, shard FROM lot_directory').fetchall())
+        with self._lock:
+            self._placement = placement
+
+    def shard_of(self, lot_id):
+        """Index of the shard holding lot_id. Unknown lots map to lot_id % shards."""
+        if not self.sharded:
+            return 0
+        with self._lock:
+            shard = self._placement.get(lot_id)
+        if shard is None:
+            # Maybe another worker created it since we loaded the directory
+            row = db.get_db().execute('SELECT shard FROM lot_directory WHERE id = ?', (lot_id,)).fetchone()
+            if row is None:
+                return lot_id % len(self.paths)
+            shard = row[0]
+            with self._lock:
+                self._placement[lot_id] = shard
+        return shard
+
+    def shard_db(self, index, snapshot=False):
+        """The request's connection to shard `index`, checked out of its pool once.
+
+        snapshot=True reads the shard's latest snapshot instead, or the live
+        file while there is none yet.
+        """
+        if snapshot and self._snapshot(index) is not None:
+            return self._snapshot_db(index)
+        if not self.sharded:
+            return db.get_db()
+        if 'shard_dbs' not in g:
+            g.shard_dbs = {}
+        if index not in g.shard_dbs:
+            g.shard_dbs[index] = self._pools[index].acquire()
+        return g.shard_dbs[index]
+
+    def _snapshot_db(self, index):
+        # Opened per request: report pages are few and their scans cost far more
+        if 'snapshot_dbs' not in g:
+            g.snapshot_dbs = {}
+        if index not in g.snapshot_dbs:
+            g.snapshot_dbs[index] = db.connect(self._snapshot(index).path, snapshot=True)
+        return g.snapshot_dbs[index]
+
+    def db(self, lot_id, snapshot=False):
+        """The request's connection to the database holding lot_id."""
+        return self.shard_db(self.shard_of(lot_id), snapshot)
+
+    def all_dbs(self):
+        """The request's connection to every shard, e.g. for streaming merges."""
+        return [self.shard_db(index) for index in range(len(self.paths))]
+
+    def _close(self, exc=None):
+        for index, conn in g.pop('shard_dbs', {}).items():
+            self._pools[index].release(conn)
+        for conn in g.pop('snapshot_dbs', {}).values():
+            conn.close()
+
+    def _held(self):
+        # Shard connections the request has checked out already. Work on a
+        # shard it holds must use that one: waiting on the pool for a second
+        # while holding the first can exhaust the pool under load.
+        return dict(g.get('shard_dbs', {})) if has_app_context() else {}
+
+    def _run(self, index, work, snapshot, held=None):
+        current = self._snapshot(index) if snapshot else None
+        if current is not None:
+            conn = db.connect(current.path, snapshot=True)
+            try:
+                return work(conn)
+            finally:
+                conn.close()
+        if held is not None:
+            return work(held)
+        conn = self._pools[index].acquire()
+        try:
+            return work(conn)
+        finally:
+            self._pools[index].release(conn)
+
+    def fan_out(self, work, snapshot=False):
+        """work(conn) on every shard in parallel; the results in shard order.
+
+        work runs on pool threads, so it must not touch the request (g,
+        session) and should fetch what it needs. It gets the request's own
+        connection to shards the request holds one to already, and one of
+        its own for the rest. snapshot=True reads the snapshots, as in
+        shard_db().
+        """
+        if not self.sharded:
+            return [work(self.shard_db(0, snapshot))]
+        held = self._held()
+        run = metrics.attributed(lambda index: self._run(index, work, snapshot, held.get(index)))
+        return list(self._executor.map(run, range(len(self.paths))))
+
+    def gather(self, work, key=None, reverse=False, snapshot=False):
+        """fan_out() for row lists: all rows in one list, sorted by key if given."""
+        rows = [row for rows in self.fan_out(work, snapshot) for row in rows]
+        if key is not None:
+            rows.sort(key=key, reverse=reverse)
+        return rows
+
+    def new_lot(self):
+        """(connection, lot_id) for creating a lot; lot_id None lets the table pick.
+
+        In sharded mode the id is taken from lot_directory first, which also
+        records the shard it goes to.
+        """
+        if not self.sharded:
+            return db.get_db(), None
+        count = len(self.paths)
+        lot_id, shard = run_with_retry(db.get_db(), lambda conn: conn.execute('''
+            INSERT INTO lot_directory (id, shard)
+            SELECT next_id, next_id % ? FROM (SELECT COALESCE(MAX(id), 0) + 1 AS next_id FROM lot_directory)
+            RETURNING id, shard
+        ''', (count,)).fetchone())
+        with self._lock:
+            self._placement[lot_id] = shard
+        return self.shard_db(shard), lot_id
+
+    def user_shard(self, user_id):
+        """Index of the shard where user_id holds a spot, or None.
+
+        Read from the user's claim, so the spot may have been freed since
+        by a command-line checkout. Unsharded this is always 0 without a
+        query; the caller looks anyway.
+        """
+        if not self.sharded:
+            return 0
+        row = db.get_db().execute('SELECT shard FROM active_users WHERE user_id = ?', (user_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def _holds_spot(self, index, user_id):
+        return self._run(index, lambda conn: conn.execute(
+            'SELECT 1 FROM parking_spots WHERE current_user_id = ? LIMIT 1', (user_id,)
+        ).fetchone() is not None, False, self._held().get(index))
+
+    def _take_claim(self, user_id, index):
+        catalog = db.get_db()
+        claimed_at = datetime.now().isoformat()
+        taken = run_with_retry(catalog, lambda conn: conn.execute('''
+            INSERT INTO active_users (user_id, shard, claimed_at) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO NOTHING
+            RETURNING user_id
+        ''', (user_id, index, claimed_at)).fetchone())
+        if taken is not None:
+            return True
+
+        claim = catalog.execute('SELECT shard, claimed_at FROM active_users WHERE user_id = ?',
+                                (user_id,)).fetchone()
+        if claim is None:
+            # Released in between
+            return self._take_claim(user_id, index)
+        stale = (datetime.now() - timedelta(seconds=CLAIM_STALE_AFTER)).isoformat()
+        if claim['claimed_at'] > stale or self._holds_spot(claim['shard'], user_id):
+            return False
+        # Left behind by a request that died mid-reserve, or its spot was
+        # freed by checkout.py; of several takers only one matches claimed_at
+        taken = run_with_retry(catalog, lambda conn: conn.execute('''
+            UPDATE active_users SET shard = ?, claimed_at = ?
+            WHERE user_id = ? AND claimed_at = ?
+            RETURNING user_id
+        ''', (index, claimed_at, user_id, claim['claimed_at'])).fetchone())
+        return taken is not None
+
+    @contextmanager
+    def claim(self, user_id, lot_id):
+        """Claim user_id's one spot for lot_id's shard while reserving it.
+
+        Raises booking.AlreadyReserved if they hold a spot, or are taking
+        one, in any shard. The claim is a catalog write made before the
+        shard is touched, so reserves in two shards can't both go ahead.
+        It is dropped again if the with block raises, except with
+        AlreadyReserved: the user does hold a spot in this shard then.
+        Unsharded this does nothing; booking's own check covers it.
+        """
+        if not self.sharded:
+            yield
+            return
+        if not self._take_claim(user_id, self.shard_of(lot_id)):
+            raise AlreadyReserved()
+        try:
+            yield
+        except AlreadyReserved:
+            raise
+        except BaseException:
+            self.release_claims([user_id])
+            raise
+
+    def release_claims(self, user_ids):
+        """Drop the claims of users whose spots were just freed."""
+        if not self.sharded or not user_ids:
+            return
+        def delete(conn):
+            conn.executemany('DELETE FROM active_users WHERE user_id = ?', [(user_id,) for user_id in user_ids])
+        if has_app_context():
+            run_with_retry(db.get_db(), delete)
+            return
+        # Schedulers and fan-out threads: outside the pool, which the request
+        # waiting on them may be holding
+        catalog = db.connect()
+        try:
+            run_with_retry(catalog, delete)
+        finally:
+            catalog.close()
+
+    def replicate_user(self, user_id):
+        """Copy one catalog user (after register or a profile edit) to every shard."""
+        if not self.sharded:
+            return
+        users = db.get_db().execute(
+            f'SELECT {", ".join(USER_COLUMNS)} FROM users WHERE id = ?', (user_id,)
+        ).fetchall()
+        self.fan_out(lambda conn: run_with_retry(conn, lambda conn: replicate_users(conn, users)))
+
+
+def _copy(conn, table, source, where, overrides=None):
+    # Column by column: older databases added some columns in another order
+    overrides = overrides or {}
+    columns = [row[1] for row in conn.execute(f'PRAGMA main.table_info({table})')]
+    source_columns = {row[1] for row in conn.execute(f'PRAGMA {source.split(".")[0]}.table_info({table})')}
+    columns = [column for column in columns if column in source_columns]
+    selected = ', '.join(overrides.get(column, f'src.{column}') for column in columns)
+    conn.execute(f'''
+        INSERT OR IGNORE INTO main.{table} ({', '.join(columns)})
+        SELECT {selected} FROM {source} src WHERE {where}
+    ''')
+
+
+def split(count, database=None):
+    """Copy an unsharded database's lots into `count` shard files.
+
+    Each lot goes to shard lot_id % count with its spots, reservations,
+    sessions (archived ones included) and rollups; ids are kept. The lot
+    tables in the catalog are left alone but no longer read. Safe to run
+    again. Returns the number of lots.
+    """
+    database = database or db.DATABASE
+    paths = shard_paths(count, database)
+    catalog = db.connect(database)
+    try:
+        lots = [row[0] for row in catalog.execute('SELECT id FROM parking_lots')]
+        catalog.executemany('INSERT OR IGNORE INTO lot_directory (id, shard) VALUES (?, ?)',
+                            [(lot_id, lot_id % count) for lot_id in lots])
+        catalog.commit()
+        users = catalog.execute(f'SELECT {", ".join(USER_COLUMNS)} FROM users').fetchall()
+    finally:
+        catalog.close()
+
+    in_shard = 'src.lot_id IN (SELECT id FROM main.parking_lots)'
+    for index, path in enumerate(paths):
+        migrate(path=path)
+        conn = db.connect(path)
+        try:
+            conn.execute('ATTACH DATABASE ? AS source', (database,))
+            conn.execute('ATTACH DATABASE ? AS source_archive', (db.archive_path(database),))
+            conn.execute('BEGIN IMMEDIATE')
+            _seed_ids(conn, index)
+            replicate_users(conn, users)
+            # available_spots starts at 0; the spot insert trigger counts it up
+            _copy(conn, 'parking_lots', 'source.parking_lots',
+                  f'src.id IN (SELECT id FROM source.lot_directory WHERE shard = {index})',
+                  {'available_spots': '0'})
+            _copy(conn, 'parking_spots', 'source.parking_spots', in_shard)
+            _copy(conn, 'reservations', 'source.reservations',
+                  'src.spot_id IN (SELECT id FROM main.parking_spots)')
+            _copy(conn, 'parking_history', 'source.parking_history', in_shard)
+            if conn.execute("SELECT 1 FROM source_archive.sqlite_master WHERE name = 'parking_history'").fetchone():
+                # Back into the hot table; the shard's own archive job moves them again
+                _copy(conn, 'parking_history', 'source_archive.parking_history', in_shard)
+            _copy(conn, 'lot_daily_stats', 'source.lot_daily_stats', in_shard)
+            conn.commit()
+        finally:
+            conn.close()
+    return len(lots)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Lot-sharded storage tools.')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    split_parser = subcommands.add_parser('split', help='move an unsharded database into shard files')
+    split_parser.add_argument('--shards', type=int, default=SHARD_COUNT, help='number of shard files')
+    args = parser.parse_args()
+
+    if args.shards <= 1:
+        parser.error('--shards (or PARKING_SHARDS) must be above 1')
+    copied = split(args.shards)
+    print(f"✅ Copied {copied} lots into {args.shards} shards; start the app with PARKING_SHARDS={args.shards}")
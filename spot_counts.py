@@ -0,0 +1,91 @@
+import argparse
+import json
+
+import booking
+from db import connect
+
+# parking_lots.available_spots is kept by triggers on parking_spots (see
+# migration 0007), in the same transaction as the spot change, so a reader
+# that sees one sees the other. The reconciler is the safety net for writes
+# made with the triggers missing, e.g. a database restored from before the
+# migration or edited by hand.
+#
+# It works through the lots a chunk at a time. Finding drift is a plain
+# read (WAL readers never block writers); only chunks with drifted lots take
+# the write lock, and only to rewrite those lots.
+RECONCILE_CHUNK = 500  # lots compared per pass
+
+
+def drift(conn, after_id=0, limit=RECONCILE_CHUNK):
+    """Lots in the next chunk after after_id whose counter disagrees with parking_spots.
+
+    Returns (last lot id looked at, {lot_id: (counter, actual)}); the id is
+    None once there are no lots left.
+    """
+    # One statement, so the counters and the spots come from the same snapshot
+    rows = conn.execute('''
+        WITH chunk AS (
+            SELECT id, available_spots FROM parking_lots
+            WHERE id > ? ORDER BY id LIMIT ?
+        ),
+        free AS (
+            SELECT lot_id, COUNT(*) AS n FROM parking_spots
+            WHERE lot_id BETWEEN (SELECT MIN(id) FROM chunk) AND (SELECT MAX(id) FROM chunk)
+              AND is_occupied IS NOT 1
+            GROUP BY lot_id
+        )
+        SELECT c.id, c.available_spots, COALESCE(f.n, 0)
+        FROM chunk c
+        LEFT JOIN free f ON f.lot_id = c.id
+        ORDER BY c.id
+    ''', (after_id, limit)).fetchall()
+    if not rows:
+        return None, {}
+    return rows[-1][0], {row[0]: (row[1], row[2]) for row in rows if row[1] != row[2]}
+
+
+def _fix(conn, lot_ids):
+    # Counted again under the write lock; a spot may have changed since the read
+    return [tuple(row) for row in conn.execute('''
+        UPDATE parking_lots
+        SET available_spots = (
+            SELECT COUNT(*) FROM parking_spots s
+            WHERE s.lot_id = parking_lots.id AND s.is_occupied IS NOT 1
+        )
+        WHERE id IN (SELECT value FROM json_each(?))
+        RETURNING id, available_spots
+    ''', (json.dumps(lot_ids),))]
+
+
+def reconcile(conn, chunk=RECONCILE_CHUNK, dry_run=False):
+    """Fix every lot whose available_spots has drifted. Returns {lot_id: (was, now)}."""
+    fixed = {}
+    after_id = 0
+    while True:
+        after_id, drifted = drift(conn, after_id, chunk)
+        if after_id is None:
+            return fixed
+        if not drifted:
+            continue
+        if dry_run:
+            fixed.update(drifted)
+            continue
+        for lot_id, count in booking.run_with_retry(conn, lambda conn: _fix(conn, list(drifted))):
+            fixed[lot_id] = (drifted[lot_id][0], count)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recount available_spots for lots that drifted.')
+    parser.add_argument('--chunk', type=int, default=RECONCILE_CHUNK, help='lots compared per pass')
+    parser.add_argument('--dry-run', action='store_true', help='only report the drift')
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        fixed = reconcile(conn, args.chunk, args.dry_run)
+    finally:
+        conn.close()
+    for lot_id, (was, now) in sorted(fixed.items()):
+        print(f"  lot {lot_id}: available_spots {was} -> {now}")
+    verb = 'Found' if args.dry_run else 'Fixed'
+    print(f"✅ {verb} {len(fixed)} drifted lots")
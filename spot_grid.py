@@ -0,0 +1,141 @@
+import re
+import threading
+
+from markupsafe import Markup
+from jinja2.utils import htmlsafe_json_dumps
+
+from cache import TTLCache
+
+# view_spots shows a lot SPOTS_PER_PAGE spots at a time, in spot id order.
+# Each page goes to the browser as a compact payload the page's script
+# expands into cards, instead of thousands of server-rendered cards:
+#   ids       runs of consecutive spot ids, [[first_id, count], ...]
+#   labels    runs of spot numbers, [[prefix, first_n, count], ...] for
+#             "Spot-1", "Spot-2", ...; [label, null, 1] for anything else
+#   occupied  run lengths of free and occupied spots, alternating, starting
+#             with free: [3, 2, 5] is 3 free, 2 occupied, 5 free
+#   users     {position on the page: email} for the occupied spots
+# so a page of 500 spots in a mostly full or mostly empty lot is a few
+# dozen bytes plus the emails.
+#
+# The encoded pages are cached per (lot, page); a spot changing drops only
+# the page it is on, a lot being edited drops all of its pages.
+SPOTS_PER_PAGE = 500
+GRID_CACHE_TTL = 300  # seconds; bounds what other worker processes may miss
+GRID_CACHE_PAGES = 2000  # pages kept at once
+
+_NUMBERED = re.compile(r'^(.*?)(\d+)$')
+
+
+def occupancy_runs(occupied):
+    """Run lengths of a list of booleans, alternating free/occupied, free first."""
+    runs = []
+    current = False
+    length = 0
+    for value in occupied:
+        if bool(value) != current:
+            runs.append(length)
+            current = not current
+            length = 0
+        length += 1
+    runs.append(length)
+    return runs
+
+
+def id_runs(ids):
+    runs = []
+    for spot_id in ids:
+        if runs and runs[-1][0] + runs[-1][1] == spot_id:
+            runs[-1][1] += 1
+        else:
+            runs.append([spot_id, 1])
+    return runs
+
+
+def label_runs(labels):
+    runs = []
+    for label in labels:
+        match = _NUMBERED.match(label or '')
+        # Leading zeros wouldn't survive prefix + str(n)
+        if match and not (len(match.group(2)) > 1 and match.group(2).startswith('0')):
+            prefix, n = match.group(1), int(match.group(2))
+            if runs and runs[-1][0] == prefix and runs[-1][1] is not None \
+                    and runs[-1][1] + runs[-1][2] == n:
+                runs[-1][2] += 1
+                continue
+            runs.append([prefix, n, 1])
+        else:
+            runs.append([label, None, 1])
+    return runs
+
+
+def load_page(conn, lot_id, page):
+    """One page of lot_id's spots, encoded. Pages count from 1.
+
+    Returns (first spot id, last spot id, payload); the ids are None for a
+    page past the end.
+    """
+    total = conn.execute('SELECT COUNT(*) FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+    spots = conn.execute('''
+        SELECT s.id, s.spot_number, s.is_occupied, u.email AS user_email
+        FROM parking_spots s
+        LEFT JOIN users u ON s.current_user_id = u.id
+        WHERE s.lot_id = ?
+        ORDER BY s.id
+        LIMIT ? OFFSET ?
+    ''', (lot_id, SPOTS_PER_PAGE, (page - 1) * SPOTS_PER_PAGE)).fetchall()
+
+    payload = {
+        'page': page,
+        'pages': max(1, -(-total // SPOTS_PER_PAGE)),
+        'total': total,
+        'offset': (page - 1) * SPOTS_PER_PAGE,
+        'ids': id_runs([spot['id'] for spot in spots]),
+        'labels': label_runs([spot['spot_number'] for spot in spots]),
+        'occupied': occupancy_runs([spot['is_occupied'] for spot in spots]),
+        'users': {position: spot['user_email'] for position, spot in enumerate(spots)
+                  if spot['is_occupied'] and spot['user_email']},
+    }
+    if not spots:
+        return None, None, payload
+    return spots[0]['id'], spots[-1]['id'], payload
+
+
+class GridCache:
+    """Encoded view_spots pages, dropped page by page as spots change."""
+
+    def __init__(self, ttl=GRID_CACHE_TTL, max_entries=GRID_CACHE_PAGES):
+        self._pages = TTLCache(ttl, max_entries)  # (lot_id, page) -> (first_id, last_id, payload JSON)
+        self._lock = threading.Lock()
+        self._ranges = {}  # lot_id -> {page: (first_id, last_id)}
+
+    def page(self, conn, lot_id, page):
+        """The page's payload as JSON that is safe inside a <script> tag."""
+        def load():
+            first_id, last_id, payload = load_page(conn, lot_id, page)
+            with self._lock:
+                self._ranges.setdefault(lot_id, {})[page] = (first_id, last_id)
+            # Encoded once here rather than on every view
+            return first_id, last_id, str(htmlsafe_json_dumps(payload))
+        return Markup(self._pages.get_or_load((lot_id, page), load)[2])
+
+    def spot_changed(self, lot_id, spot_id):
+        with self._lock:
+            pages = [page for page, (first_id, last_id) in self._ranges.get(lot_id, {}).items()
+                     if first_id is not None and first_id <= spot_id <= last_id]
+        # Called even with no page to drop, so a page loading right now isn't cached
+        self._pages.invalidate(*((lot_id, page) for page in pages))
+
+    def lot_changed(self, lot_id=None):
+        """Drop lot_id's pages (every lot's when None) after a lot was created, edited or deleted."""
+        if lot_id is None:
+            with self._lock:
+                self._ranges.clear()
+            self._pages.clear()
+            return
+        with self._lock:
+            pages = list(self._ranges.pop(lot_id, {}))
+        self._pages.invalidate(*((lot_id, page) for page in pages))
+
+    def stats(self):
+        return self._pages.stats()
@@ -0,0 +1,144 @@
+import argparse
+import math
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # optional: batches fall back to plain Python
+    np = None
+
+import archive
+import booking
+import rollups
+from db import connect
+
+# Rows re-billed per transaction, so a full re-bill never holds the write
+# lock for long and can be interrupted without losing finished chunks.
+REBILL_CHUNK = 10000
+
+# Tariff: base_price covers the first base_duration hours, then
+# extra_hour_price per hour (pro rata) after that. Costs are rounded half-up
+# to the cent with floor(x * 100 + 0.5) / 100 on both the scalar and the
+# NumPy path, so a session costs the same at checkout and after a re-bill.
+
+
+def round_cents(amount):
+    return math.floor(amount * 100 + 0.5) / 100
+
+
+def duration_hours(entry_time, exit_time):
+    if isinstance(entry_time, str):
+        entry_time = datetime.fromisoformat(entry_time)
+    if isinstance(exit_time, str):
+        exit_time = datetime.fromisoformat(exit_time)
+    return (exit_time - entry_time).total_seconds() / 3600
+
+
+def cost(hours, base_price, base_duration, extra_hour_price):
+    """Cost of one session of `hours` under a lot's tariff."""
+    if hours <= base_duration:
+        return round_cents(base_price)
+    return round_cents(base_price + (hours - base_duration) * extra_hour_price)
+
+
+def costs(hours, base_price, base_duration, extra_hour_price):
+    """Element-wise cost() over equal-length sequences. Returns a list of floats."""
+    if np is None:
+        return [cost(*args) for args in zip(hours, base_price, base_duration, extra_hour_price)]
+
+    hours = np.asarray(hours, dtype=np.float64)
+    base_price = np.asarray(base_price, dtype=np.float64)
+    base_duration = np.asarray(base_duration, dtype=np.float64)
+    extra_hour_price = np.asarray(extra_hour_price, dtype=np.float64)
+
+    amount = np.where(hours <= base_duration, base_price,
+                      base_price + (hours - base_duration) * extra_hour_price)
+    return (np.floor(amount * 100 + 0.5) / 100).tolist()
+
+
+def quote(conn, lot_id, hours):
+    """What parking `hours` at lot_id would cost now, or None for an unknown lot."""
+    lot = conn.execute('''
+        SELECT id, name, base_price, base_duration, extra_hour_price
+        FROM parking_lots WHERE id = ?
+    ''', (lot_id,)).fetchone()
+    if not lot:
+        return None
+    return {
+        'lot_id': lot['id'],
+        'lot_name': lot['name'],
+        'hours': hours,
+        'base_price': lot['base_price'],
+        'base_duration': lot['base_duration'],
+        'extra_hour_price': lot['extra_hour_price'],
+        'cost': cost(hours, lot['base_price'], lot['base_duration'], lot['extra_hour_price']),
+    }
+
+
+def _rebill_chunk(conn, table, after_id, lot_id, chunk):
+    where = 'h.id > ? AND h.exit_time IS NOT NULL AND h.cost IS NOT NULL'
+    params = [after_id]
+    if lot_id is not None:
+        where += ' AND h.lot_id = ?'
+        params.append(lot_id)
+
+    rows = conn.execute(f'''
+        SELECT h.id, h.entry_time, h.exit_time, h.cost,
+               l.base_price, l.base_duration, l.extra_hour_price
+        FROM {table} h
+        JOIN parking_lots l ON h.lot_id = l.id
+        WHERE {where}
+        ORDER BY h.id
+        LIMIT ?
+    ''', params + [chunk]).fetchall()
+    if not rows:
+        return None, 0, 0
+
+    new_costs = costs(
+        [duration_hours(row['entry_time'], row['exit_time']) for row in rows],
+        [row['base_price'] for row in rows],
+        [row['base_duration'] for row in rows],
+        [row['extra_hour_price'] for row in rows],
+    )
+    changed = [(new, row['id']) for row, new in zip(rows, new_costs) if new != row['cost']]
+    conn.executemany(f'UPDATE {table} SET cost = ? WHERE id = ?', changed)
+    return rows[-1]['id'], len(rows), len(changed)
+
+
+def rebill(conn, lot_id=None, chunk=REBILL_CHUNK):
+    """Recompute the cost of every billed, closed session under current tariffs.
+
+    Sessions closed without a charge (cost NULL) stay unbilled. Works through
+    parking_history and its archive by id, one transaction per chunk, then
+    rebuilds the analytics rollups. Returns (sessions examined, sessions changed).
+    """
+    examined = changed = 0
+    for table in archive.history_tables(conn):
+        after_id = 0
+        while True:
+            last_id, n, n_changed = booking.run_with_retry(
+                conn, lambda conn: _rebill_chunk(conn, table, after_id, lot_id, chunk))
+            if last_id is None:
+                break
+            after_id = last_id
+            examined += n
+            changed += n_changed
+
+    if changed:
+        booking.run_with_retry(conn, rollups.rebuild)
+    return examined, changed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-bill closed parking sessions under current tariffs.')
+    parser.add_argument('command', choices=['rebill'])
+    parser.add_argument('--lot', type=int, help='only re-bill sessions at this lot')
+    parser.add_argument('--chunk', type=int, default=REBILL_CHUNK, help='sessions per transaction')
+    args = parser.parse_args()
+
+    conn = connect(archive=True)
+    try:
+        examined, changed = rebill(conn, args.lot, args.chunk)
+    finally:
+        conn.close()
+    print(f"✅ Re-billed {examined} sessions ({changed} costs changed)")
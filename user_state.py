@@ -0,0 +1,36 @@
+# What user_dashboard needs about the logged-in user: the spot they hold (if
+# any) joined onto its lot, in one indexed lookup. The lots to choose from
+# come from the pin code index (lot_index.py), and known vehicle numbers
+# from user_vehicles through a per-user cache in app.py.
+
+
+def current_spot(conn, user_id):
+    """Returns (spot, lot) as dicts for the spot user_id holds, or (None, None)."""
+    row = conn.execute('''
+        SELECT l.*,
+               s.id AS my_spot_id,
+               s.spot_number AS my_spot_number
+        FROM parking_spots s
+        JOIN parking_lots l ON l.id = s.lot_id
+        WHERE s.current_user_id = ?
+        LIMIT 1
+    ''', (user_id,)).fetchone()
+    if row is None:
+        return None, None
+
+    lot = dict(row)
+    spot = {'id': lot.pop('my_spot_id'), 'lot_id': lot['id'], 'spot_number': lot.pop('my_spot_number'),
+            'is_occupied': 1, 'current_user_id': user_id}
+    return spot, lot
+
+
+def merge_current_spots(results):
+    """The one current_spot() result from several shards that found a spot."""
+    return next(((spot, lot) for spot, lot in results if spot), (None, None))
+
+
+def vehicle_numbers(conn, user_id):
+    """Every plate user_id has parked with, oldest first."""
+    return tuple(row[0] for row in conn.execute(
+        'SELECT vehicle_number FROM user_vehicles WHERE user_id = ? ORDER BY id', (user_id,)
+    ))
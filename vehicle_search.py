@@ -0,0 +1,53 @@
+# Admin vehicle lookup over user_vehicles (one row per user and plate) instead
+# of a LIKE scan + GROUP BY over all of parking_history. Substring matches go
+# through the FTS5 trigram index when SQLite has it.
+
+# The trigram tokenizer can't match anything shorter than this
+MIN_TRIGRAM_LENGTH = 3
+
+_fts_available = None
+
+
+def has_fts(conn):
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'vehicle_search_fts'"
+        ).fetchone() is not None
+    return _fts_available
+
+
+def _fts_phrase(term):
+    # Quote the whole term so FTS5 treats it as a literal phrase, not syntax
+    return '"' + term.replace('"', '""') + '"'
+
+
+def list_all(conn):
+    return conn.execute('''
+        SELECT u.full_name, u.email, v.vehicle_number
+        FROM user_vehicles v
+        JOIN users u ON v.user_id = u.id
+        ORDER BY u.full_name
+    ''').fetchall()
+
+
+def search(conn, term):
+    """Users and plates where the name, email or plate contains term."""
+    if has_fts(conn) and len(term) >= MIN_TRIGRAM_LENGTH:
+        return conn.execute('''
+            SELECT u.full_name, u.email, v.vehicle_number
+            FROM vehicle_search_fts f
+            JOIN user_vehicles v ON v.id = f.rowid
+            JOIN users u ON v.user_id = u.id
+            WHERE vehicle_search_fts MATCH ?
+            ORDER BY u.full_name
+        ''', (_fts_phrase(term),)).fetchall()
+
+    like_search = f'%{term}%'
+    return conn.execute('''
+        SELECT u.full_name, u.email, v.vehicle_number
+        FROM user_vehicles v
+        JOIN users u ON v.user_id = u.id
+        WHERE u.full_name LIKE ? OR u.email LIKE ? OR v.vehicle_number LIKE ?
+        ORDER BY u.full_name
+    ''', (like_search, like_search, like_search)).fetchall()